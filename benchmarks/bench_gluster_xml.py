@@ -0,0 +1,180 @@
+#!/usr/bin/python
+#  This file is part of DiSTAF
+#  Copyright (C) 2015-2016  Red Hat, Inc. <http://www.redhat.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Microbenchmark of distaf.gluster_xml against the DOM based parsing which
+    get_volume_info and get_volume_status used before.
+
+    The outputs of gluster volume info/status --xml captured in fixtures/
+    are scaled to the given number of volumes by repeating their volume
+    element. The results of both the parsers are checked to be the same.
+
+    Usage: python benchmarks/bench_gluster_xml.py [--volumes N] [--repeat R]
+"""
+
+
+import os
+import re
+import sys
+import time
+import argparse
+try:
+    import xml.etree.cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from distaf.gluster_xml import parse_volume_info, parse_volume_status
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def legacy_volume_info(output):
+    root = etree.XML(output)
+    volinfo = {}
+    for volume in root.findall("volInfo/volumes/volume"):
+        for elem in volume.getchildren():
+            if elem.tag == "name":
+                volname = elem.text
+                volinfo[volname] = {}
+            elif elem.tag == "bricks":
+                volinfo[volname]["bricks"] = []
+                for el in elem.getiterator():
+                    if el.tag == "name":
+                        volinfo[volname]["bricks"].append(el.text)
+            elif elem.tag == "options":
+                volinfo[volname]["options"] = {}
+                for option in elem.findall("option"):
+                    for el in option.getchildren():
+                        if el.tag == "name":
+                            opt = el.text
+                        if el.tag == "value":
+                            volinfo[volname]["options"][opt] = el.text
+            else:
+                volinfo[volname][elem.tag] = elem.text
+    return volinfo
+
+
+def legacy_parse_xml(tag_obj):
+    node_dict = {}
+    for tag in tag_obj:
+        if re.search(r'\n\s+', tag.text) is not None:
+            node_dict[tag.tag] = legacy_parse_xml(tag)
+        else:
+            node_dict[tag.tag] = tag.text
+    return node_dict
+
+
+def legacy_volume_status(output):
+    root = etree.XML(output)
+    vol_status = {}
+    for volume in root.findall("volStatus/volumes/volume"):
+        tmp_dict1 = {}
+        tmp_dict2 = {}
+        vol_name = [vol.text for vol in volume if vol.tag == "volName"]
+        for each_node in volume.findall("node"):
+            if each_node.find('path').text.startswith('/'):
+                node_name = each_node.find('hostname').text
+            else:
+                node_name = each_node.find('path').text
+            node_dict = legacy_parse_xml(each_node)
+            tmp_dict3 = {}
+            if node_dict['path'].startswith('/'):
+                tmp = node_dict["path"]
+                tmp_dict3[node_dict["path"]] = node_dict
+            else:
+                tmp_dict3[node_dict["hostname"]] = node_dict
+                tmp = node_dict["hostname"]
+            del tmp_dict3[tmp]["path"]
+            del tmp_dict3[tmp]["hostname"]
+            tmp_dict1.setdefault(node_name, []).append(tmp_dict3)
+            tmp_dict4 = {}
+            for item in tmp_dict1[node_name]:
+                for key, val in item.items():
+                    tmp_dict4[key] = val
+            tmp_dict2[node_name] = tmp_dict4
+        vol_status[vol_name[0]] = tmp_dict2
+    return vol_status
+
+
+def scale_fixture(name, nvolumes, name_tag):
+    """
+        Returns the fixture with its volume repeated nvolumes times, each
+        with a unique name
+    """
+    with open(os.path.join(FIXTURES, name)) as fhandle:
+        output = fhandle.read()
+    match = re.search(r'(\s*<volume>.*</volume>)', output, re.S)
+    volume = match.group(1)
+    volumes = []
+    for i in range(nvolumes):
+        volumes.append(re.sub(r'<%s>(\w+)</%s>' % (name_tag, name_tag), \
+                r'<%s>\g<1>%d</%s>' % (name_tag, i, name_tag), volume, 1))
+    return output[:match.start()] + ''.join(volumes) + output[match.end():]
+
+
+def to_dict(volumes):
+    return dict([(name, dict([(key, volume[key]) \
+            for key in volume.keys()])) for name, volume in volumes.items()])
+
+
+def best_of(repeat, func, *args):
+    times = []
+    for _ in range(repeat):
+        started = time.time()
+        func(*args)
+        times.append(time.time() - started)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--volumes', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    info = scale_fixture('volume_info.xml', args.volumes, 'name')
+    status = scale_fixture('volume_status.xml', args.volumes, 'volName')
+    middle = 'testvol%d' % (args.volumes // 2)
+    assert to_dict(parse_volume_info(info)) == legacy_volume_info(info)
+    assert to_dict(parse_volume_status(status)) == \
+            legacy_volume_status(status)
+
+    cases = [
+        ('volume info, all volumes (legacy)', legacy_volume_info, info),
+        ('volume info, all volumes', \
+                lambda out: parse_volume_info(out).values(), info),
+        ('volume info, one volume', \
+                lambda out: parse_volume_info(out)[middle], info),
+        ('volume status, all volumes (legacy)', legacy_volume_status, \
+                status),
+        ('volume status, all volumes', \
+                lambda out: parse_volume_status(out).values(), status),
+        ('volume status, one volume', \
+                lambda out: parse_volume_status(out)[middle], status),
+    ]
+    print("%d volumes, best of %d runs" % (args.volumes, args.repeat))
+    for title, func, output in cases:
+        print("%-40s %8.2f ms" % (title, \
+                best_of(args.repeat, func, output) * 1000))
+
+
+if __name__ == '__main__':
+    main()
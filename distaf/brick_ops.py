@@ -39,12 +39,13 @@ def add_brick(volname, nbricks, replica=1, stripe=1, peers='', mnode=''):
         mnode = tc.nodes[0]
     replica = int(replica)
     stripe = int(stripe)
-    volinfo = tc.run(mnode, "gluster volume info | egrep \"^Brick[0-9]+\"", \
-            verbose=False)
+    # The bricks are filtered here, so that the query can be cached
+    volinfo = tc.run_cached(mnode, "gluster volume info", verbose=False)
     if volinfo[0] != 0:
         tc.logger.error("Unable to get volinfo for add-brick")
         return (-1, -1, -1)
-    bi = int(re.findall(r"%s_brick([0-9]+)" % volname, volinfo[1])[-1]) + 1
+    bricks = '\n'.join(re.findall(r'^Brick[0-9]+.*$', volinfo[1], re.M))
+    bi = int(re.findall(r"%s_brick([0-9]+)" % volname, bricks)[-1]) + 1
     tempn = 0
     n = 0
     add_bricks = ''
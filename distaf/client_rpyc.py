@@ -17,10 +17,482 @@
 
 
 import os
+import re
+import math
 import time
+import random
+import pickle
+import select
+import socket
+import atexit
+import inspect
 import logging
+import itertools
+import tempfile
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+import rpyc
 from plumbum import SshMachine
 from rpyc.utils.zerodeploy import DeployedServer
+from distaf import remote_agent
+from distaf.stats import CommandStats, find_caller
+from distaf.log_pipeline import QueueHandler, ArtifactHandler, LogListener
+
+# rpyc.async was renamed to rpyc.async_ as async is a keyword in newer python
+rpyc_async = getattr(rpyc, 'async_', None) or getattr(rpyc, 'async')
+
+# Name of the remote_agent module in the remote nodes
+AGENT_MODULE = 'distaf_remote_agent'
+
+# Return code of commands killed for not completing within their timeout.
+# Same as that of the timeout(1) command.
+TIMEOUT_RETCODE = 124
+
+# gluster commands which only query the cluster state. Any other command
+# mentioning gluster (including glusterd restarts) may change the state and
+# invalidates the cached query results. The subcommand has to be a query, so
+# volume names like status-vol do not count, and commands chained or piped
+# with others (;, &&, |, `) are not queries.
+GLUSTER_QUERY = re.compile(r'^(?=[^;&|`\n]*$)\s*gluster\s+(--mode=script\s+)?('
+                           r'--version|--print-\S+|'
+                           r'(volume|vol|v)\s+(info|status|list|get)|'
+                           r'(volume|vol|v)\s+(rebalance|heal|quota)\s+\S+\s+'
+                           r'(status|info|list)|'
+                           r'(volume|vol|v)\s+geo-replication(\s+\S+){0,2}'
+                           r'\s+status|'
+                           r'peer\s+status|pool\s+list|'
+                           r'snapshot\s+(info|status|list))(?=\s|$)')
+# gluster CLI commands, and their failure on the cluster wide transaction
+# lock of glusterd being held by another command
+GLUSTER_CLI = re.compile(r'^\s*gluster\s')
+GLUSTER_BUSY = re.compile(r'Another transaction is in progress|'
+                          r'Locking failed on')
+# Commands which may change the cluster state without mentioning gluster,
+# like restarting services or killing processes (bricks, glusterd)
+STATE_CHANGE = re.compile(r'\b(service|systemctl|kill|pkill|killall|'
+                          r'reboot|shutdown|ifdown|iptables)\b')
+
+
+def _parallel_map(func, items, max_workers):
+    """
+        Calls func on each of the items from a pool of at most max_workers
+        threads. func is expected to handle its own exceptions.
+
+        Returns a dict of item to the return value of func(item)
+    """
+    items = list(items)
+    work = queue.Queue()
+    for item in items:
+        work.put(item)
+    results = {}
+
+    def worker():
+        while True:
+            try:
+                item = work.get_nowait()
+            except queue.Empty:
+                return
+            results[item] = func(item)
+
+    workers = []
+    for _ in range(max(1, min(int(max_workers), len(items)))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        workers.append(thread)
+    for thread in workers:
+        thread.join()
+    return results
+
+
+class ConnectionPool():
+    """
+        A pool of rpyc connections to the DeployedServer of each user@node
+
+        Connections are checked out for a task and checked back in once the
+        task is done, so that they can be reused instead of connecting again.
+        At most max_size idle connections are kept per user@node and
+        connections idle for more than idle_timeout seconds are evicted.
+    """
+    # Idle connections older than this (in seconds) are pinged before reuse
+    health_check_after = 5
+
+    def __init__(self, max_size=4, idle_timeout=300):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    def checkout(self, node, user, deployed):
+        """
+            Returns an idle healthy connection to user@node if there is one.
+            Otherwise a new connection is made through deployed.
+            Raises an exception if the connection could not be made.
+        """
+        key = (node, user)
+        conn = None
+        while conn is None:
+            with self._lock:
+                if not self._idle.get(key):
+                    break
+                conn, last_used = self._idle[key].pop()
+            if not self._is_healthy(conn, last_used):
+                self._close(conn)
+                conn = None
+        if conn is None:
+            conn = deployed.classic_connect()
+        with self._lock:
+            self._owners[conn] = key
+        return conn
+
+    def checkin(self, conn):
+        """
+            Returns the connection checked out earlier back to the pool.
+            Connections which are closed or not from the pool are ignored.
+        """
+        with self._lock:
+            key = self._owners.pop(conn, None)
+            if key is None or conn.closed:
+                return
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_size:
+                idle.append((conn, time.time()))
+                conn = None
+        if conn is not None:
+            self._close(conn)
+        self.evict_idle()
+
+    def evict_idle(self):
+        """
+            Closes all the connections idle for more than idle_timeout
+        """
+        now = time.time()
+        expired = []
+        with self._lock:
+            for key, idle in self._idle.items():
+                expired.extend([conn for conn, last_used in idle \
+                        if now - last_used > self.idle_timeout])
+                idle[:] = [(conn, last_used) for conn, last_used in idle \
+                        if now - last_used <= self.idle_timeout]
+        for conn in expired:
+            self._close(conn)
+
+    def discard(self, node, user=None):
+        """
+            Closes all idle connections of node (and user if specified).
+            To be used when the DeployedServer of the node is re-created.
+        """
+        discarded = []
+        with self._lock:
+            for key in list(self._idle.keys()):
+                if key[0] == node and (user is None or key[1] == user):
+                    discarded.extend([conn for conn, _ in self._idle.pop(key)])
+        for conn in discarded:
+            self._close(conn)
+
+    def close_all(self):
+        """
+            Closes all the idle connections in the pool
+        """
+        with self._lock:
+            nodes = set([key[0] for key in self._idle])
+        for node in nodes:
+            self.discard(node)
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.time() - last_used < self.health_check_after:
+            return True
+        try:
+            conn.ping()
+        except:
+            return False
+        return True
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except:
+            pass
+
+
+class QueryCache():
+    """
+        Cache of the results of the read-only queries (like gluster volume
+        info) run through BigBang.run_cached. The results are keyed by node,
+        user and the command, and are valid for ttl seconds or till the
+        cache is invalidated. A ttl of 0 disables the cache.
+    """
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self.generation = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+            Returns the cached result for key or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+    def put(self, key, result, generation):
+        """
+            Caches the result of the query started when the cache was at
+            generation. It is dropped if the cache was invalidated since,
+            as the result may predate the change which invalidated it.
+        """
+        if not self.ttl:
+            return
+        with self._lock:
+            if generation == self.generation:
+                self._entries[key] = (time.time() + self.ttl, result)
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+class SharedCall():
+    """
+        Result of a command run on behalf of many callers (see BigBang.run)
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = (-1, -1, -1)
+
+    def wait(self):
+        """
+            Waits for the command to complete and returns its result
+        """
+        self.event.wait()
+        return self.result
+
+
+class RemoteStream():
+    """
+        Stdout of a command running in the remote node, which is read as and
+        when it arrives over the rpyc connection instead of in one go.
+
+        Iterating over the stream yields the lines of stdout and chunks()
+        yields the raw chunks. The stderr of the command is collected in a
+        temporary file on the remote node. returncode and stderr are set once
+        the stream is exhausted or closed.
+    """
+    def __init__(self, conn, popen, errfile, chunk_size=65536, on_close=None):
+        self.conn = conn
+        self.popen = popen
+        self.errfile = errfile
+        self.chunk_size = chunk_size
+        self.on_close = on_close
+        self.returncode = None
+        self.stderr = None
+        self.nbytes = 0
+        self._fd = popen.stdout.fileno()
+
+    def chunks(self):
+        """
+            Yields the stdout in chunks of at most chunk_size bytes
+        """
+        read = self.conn.modules.os.read
+        while self.returncode is None:
+            chunk = read(self._fd, self.chunk_size)
+            if not chunk:
+                break
+            self.nbytes += len(chunk)
+            yield chunk
+        self.close()
+
+    def __iter__(self):
+        partial = ''
+        for chunk in self.chunks():
+            lines = (partial + chunk).split('\n')
+            partial = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if partial:
+            yield partial
+
+    def close(self):
+        """
+            Waits for the command to exit and collects the retcode and stderr.
+            If the stdout is not read completely, the rest is discarded.
+        """
+        if self.returncode is not None:
+            return self.returncode
+        self.popen.stdout.close()
+        self.returncode = self.popen.wait()
+        self.errfile.seek(0)
+        self.stderr = self.errfile.read()
+        self.errfile.close()
+        if self.on_close is not None:
+            self.on_close(self)
+        return self.returncode
+
+
+class AsyncCommand():
+    """
+        Handle of a command started in a remote node with BigBang.arun
+
+        The command is waited upon with an rpyc asynchronous request, so no
+        local thread is needed per command. Any number of these can be in
+        flight and collected together with BigBang.gather.
+    """
+    def __init__(self, bigbang, node, user, cmd, conn, popen, timeout=None, \
+            verbose=True, log=True):
+        self.bigbang = bigbang
+        self.node = node
+        self.user = user
+        self.cmd = cmd
+        self.conn = conn
+        self.popen = popen
+        self.pid = popen.pid
+        self.verbose = verbose
+        self.log = log
+        self.timeout = timeout
+        self.cancelled = False
+        self.timed_out = False
+        self.caller = find_caller()
+        self.started = time.time()
+        self.duration = None
+        self._result = None
+        self._async = rpyc_async(popen.communicate)()
+        if timeout:
+            self._async.set_expiry(timeout)
+
+    @property
+    def ready(self):
+        """
+            True if the command has completed. Does not block.
+        """
+        return self._result is not None or self._async.ready
+
+    @property
+    def done(self):
+        """
+            True if value() would not block, i.e. the command has completed
+            or it has timed out. Does not block.
+        """
+        return self.ready or self._async.expired
+
+    def cancel(self):
+        """
+            Cancels the command by killing it in the remote node
+        """
+        if self._result is not None:
+            return False
+        self.cancelled = True
+        return self.bigbang.kill_remote(self.node, self.pid, self.user)
+
+    def close(self):
+        """
+            Abandons the command and closes its connection, unless the
+            connection is already back in the pool
+        """
+        if self._result is None:
+            self.conn.close()
+
+    def _wait_killed(self):
+        """
+            Waits at most 'kill_timeout' seconds (from config, 10 by
+            default) for the killed command to exit.
+
+            Returns True if it exited, False otherwise
+        """
+        self._async.set_expiry(self.bigbang.global_config.get( \
+                'kill_timeout', 10))
+        try:
+            self._async.wait()
+        except rpyc.AsyncResultTimeout:
+            return False
+        return True
+
+    def _abandon(self):
+        """
+            Gives up on the connection of a command which did not exit even
+            after being killed (like a process in D state). The connection
+            stays blocked till the command exits, so it is closed, and
+            replaced if it is the main connection to the node.
+        """
+        self.bigbang.logger.error("\"%s\" on %s did not exit after being "
+                                  "killed. Abandoning its connection" \
+                                  % (self.cmd, self.node))
+        handles = self.bigbang.connection_handles.get(self.node, {})
+        is_main = self.user in handles and handles[self.user][2] is self.conn
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        if is_main:
+            self.bigbang.recover_connection(self.node, self.user)
+
+    def value(self):
+        """
+            Waits for the command to complete and returns the tuple of
+            (retcode, stdout, stderr). If the command does not complete
+            within the timeout, it is killed along with its children and
+            the retcode is TIMEOUT_RETCODE.
+        """
+        if self._result is not None:
+            return self._result
+        try:
+            self._async.wait()
+            pout, perr = self._async.value
+        except rpyc.AsyncResultTimeout:
+            self.bigbang.logger.error("\"%s\" on %s timed out after %s "
+                                      "seconds. Killing it" \
+                                      % (self.cmd, self.node, self.timeout))
+            self.timed_out = True
+            self.cancel()
+            pout, perr = ('', '')
+        if self.timed_out and not self._wait_killed():
+            self._abandon()
+            retc = TIMEOUT_RETCODE
+        else:
+            # A cancelled command has its reply discarded, but the
+            # connection serves this only after the command has been killed
+            retc = self.popen.wait()
+        self.bigbang.check_mutation(self.cmd)
+        if self.timed_out:
+            retc = TIMEOUT_RETCODE
+        self.duration = time.time() - self.started
+        self.bigbang.put_connection(self.conn)
+        self._result = (retc, pout, perr)
+        if not self.log:
+            return self._result
+        self.bigbang.stats.record('run_async', self.node, self.caller, \
+                self.duration, len(self.cmd) + len(pout) + len(perr))
+        self.bigbang.log_output(self.cmd, self.node, retc, pout, perr, \
+                self.verbose, logging.DEBUG)
+        return self._result
+
+
+class CircuitBreaker():
+    """
+        Circuit breaker of the connection to a user@node
+
+        The breaker is open while the node is known to be unreachable and
+        a background thread is trying to connect to it again. Calls to
+        the node fail fast while the breaker is open.
+    """
+    def __init__(self):
+        self.thread = None
+        self.opened_at = None
+        self.failures = 0
+
+    @property
+    def is_open(self):
+        return self.thread is not None and self.thread.is_alive()
 
 
 class BigBang():
@@ -53,20 +525,125 @@ class BigBang():
         formatter = logging.Formatter('%(asctime)s %(levelname)s %(funcName)s '
                                      '%(message)s')
         self.lhndlr.setFormatter(formatter)
-        self.logger.addHandler(self.lhndlr)
+        # Outputs longer than log_output_limit are truncated in the logs.
+        # The full output is written to a file in artifact_dir
+        self.log_output_limit = self.global_config.get('log_output_limit', 0)
+        self.artifact_dir = self.global_config.get('artifact_dir', \
+                os.path.join(client_logdir, 'artifacts'))
+        self.artifact_seq = itertools.count(1)
+        self.current_test = None
+        self.test_lhndlr = None
+        # With async_logging, the log files are written by a background
+        # thread, so that logging does not slow down the commands
+        self.log_listener = None
+        if self.global_config.get('async_logging', True):
+            self.log_listener = LogListener(queue.Queue(), self.lhndlr, \
+                    ArtifactHandler())
+            self.log_listener.start()
+            atexit.register(self.log_listener.stop)
+            self.logger.addHandler(QueueHandler(self.log_listener.queue))
+        else:
+            self.logger.addHandler(self.lhndlr)
+            self.logger.addHandler(ArtifactHandler())
         self.logger.setLevel(loglevel)
 
         # Make connections
         self.connection_handles = {}
         self.subp_conn = {}
-        for node in self.all_nodes:
+        self.connection_times = {}
+        self.agents = {}
+        self.breakers = {}
+        self.breaker_lock = threading.Lock()
+        self.node_locks = {}
+        self.stats = CommandStats()
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
+        # Serialises the gluster CLI commands which change the cluster
+        # state, when volumes are set up or cleaned up in the background
+        self.gluster_lock = threading.RLock()
+        self.serialise_gluster = not self.global_config.get('global_mode') \
+                and bool(self.global_config.get('volume_pool_size') or \
+                self.global_config.get('pipeline_setup'))
+        self.query_cache = QueryCache( \
+                self.global_config.get('query_cache_ttl', 30))
+        self.conn_pool = ConnectionPool( \
+                self.global_config.get('conn_pool_max_size', 4), \
+                self.global_config.get('conn_pool_idle_timeout', 300))
+        # In lazy mode, nodes are connected to when they are first used
+        self.lazy_connect = self.global_config.get('lazy_connect', False)
+        if not self.lazy_connect:
+            self.connect_nodes(self.all_nodes)
+
+    def ensure_connection(self, node, user=''):
+        """
+            Connects to user@node if it is not connected yet. This is how
+            nodes get connected in the lazy_connect mode.
+            Returns True if the node is connected and False otherwise
+        """
+        if user == '':
+            user = self.user
+        if user in self.connection_handles.get(node, {}):
+            return True
+        with self.node_locks.setdefault(node, threading.Lock()):
+            if user in self.connection_handles.get(node, {}):
+                return True
+            self.logger.debug("Connecting to %s@%s on first use" \
+                    % (user, node))
+            return self.recover_connection(node, user)
+
+    def prewarm(self, nodes, user=''):
+        """
+            Connects in parallel to the nodes which are not connected yet.
+            Used in lazy_connect mode to connect upfront to the nodes a
+            test is going to use (prewarm_nodes in test config).
+        """
+        if user == '':
+            user = self.user
+        nodes = [node for node in set(nodes) \
+                if user not in self.connection_handles.get(node, {})]
+        if nodes:
+            self.connect_nodes(nodes, user)
+
+    def connect_nodes(self, nodes, user=''):
+        """
+            Establishes connection to all the nodes in parallel. At most
+            'max_connect_workers' (from config, defaults to 16) handshakes
+            are in flight at any point of time.
+
+            The time taken to connect to each node is stored in the dict
+            connection_times and a report is logged.
+            Returns a dict of node to True/False (connected or not)
+        """
+        if user == '':
+            user = self.user
+        max_workers = self.global_config.get('max_connect_workers', 16)
+
+        def connect(node):
             self.logger.debug("Connecting to node: %s" % node)
-            ret = self.establish_connection(node, self.user)
+            start = time.time()
+            ret = self.establish_connection(node, user)
+            self.connection_times[node] = time.time() - start
             if not ret:
                 self.logger.warning("Unable to establish connection with: %s" \
                         % node)
             else:
-                self.logger.debug("Connected to node: %s" % node)
+                self.logger.debug("Connected to node: %s in %.2f seconds" \
+                        % (node, self.connection_times[node]))
+            return ret
+
+        start = time.time()
+        status = _parallel_map(connect, nodes, max_workers)
+        if status:
+            slowest = max(status, key=lambda node: self.connection_times[node])
+            self.logger.info("Connected to %d of %d nodes in %.2f seconds. "
+                             "Slowest node is %s (%.2f seconds)" \
+                             % (len([n for n in status if status[n]]), len(status), \
+                             time.time() - start, slowest, \
+                             self.connection_times[slowest]))
+        for node in sorted(status):
+            self.logger.debug("Connection time for %s: %.2f seconds" \
+                    % (node, self.connection_times[node]))
+        return status
 
     def establish_connection(self, node, user):
         """
@@ -88,153 +665,827 @@ class BigBang():
             conn = dep.classic_connect()
             self.connection_handles[node][user] = (rem, dep, conn)
             self.subp_conn[node][user] = conn.modules.subprocess
+            self.deploy_agent(node, user, conn)
         except:
             return False
         return True
 
-    def refresh_connection(self, node, user='', timeout=210):
+    def deploy_agent(self, node, user, conn):
+        """
+            Copies the remote_agent module to a temporary directory in the
+            node and imports it in the DeployedServer there. The imported
+            module is shared by all connections to that DeployedServer.
+        """
+        rdir = conn.modules.tempfile.mkdtemp(prefix='distaf-')
+        rfh = conn.builtin.open("%s/%s.py" % (rdir, AGENT_MODULE), 'w')
+        rfh.write(inspect.getsource(remote_agent))
+        rfh.close()
+        conn.modules.sys.path.insert(0, rdir)
+        self.agents.setdefault(node, {})[user] = conn.modules[AGENT_MODULE]
+
+    def call_agent(self, node, func, args=(), user=''):
+        """
+            Calls the function func of the remote_agent in the node with
+            the args. The args and the return value are passed by value.
+
+            Returns the return value of func or None if unable to connect
+            to the node
+        """
+        return self._call_agent(node, func, args, user, find_caller())
+
+    def _call_agent(self, node, func, args, user, caller):
+        """
+            call_agent, recording the call in stats (as the op func) on
+            behalf of caller
+        """
+        if user == '':
+            user = self.user
+        started = time.time()
+        self.ensure_connection(node, user)
+        payload = pickle.dumps(tuple(args), 2)
+        try:
+            ret = self.agents[node][user].call(func, payload)
+        except (KeyError, EOFError, socket.error):
+            ret = self.recover_connection(node, user)
+            if not ret:
+                self.logger.critical("Unable to connect to %s@%s" \
+                        % (user, node))
+                return None
+            ret = self.agents[node][user].call(func, payload)
+        self.stats.record(func, node, caller, time.time() - started, \
+                len(payload) + len(ret))
+        return pickle.loads(ret)
+
+    def refresh_connection(self, node, user='', timeout=''):
         """
             Refresh the connection to the user@node
 
             This should be called either from test script, but internally
             run/run_async will also call this if connection is found to be
             disconnected. Any reboot will make the connection go bad.
+
+            Blocks till the connection is re-established, retrying with
+            exponential backoff for at most timeout seconds (defaults to
+            'reconnect_timeout' from config or 210). If the connection is
+            already being re-established in background, waits for that.
+            Returns True on success and False otherwise
+        """
+        if user == '':
+            user = self.user
+        if timeout == '':
+            timeout = self.global_config.get('reconnect_timeout', 210)
+        breaker = self.breakers.setdefault((node, user), CircuitBreaker())
+        if breaker.is_open:
+            breaker.thread.join(timeout)
+            ret = not breaker.is_open and breaker.failures == 0
+        else:
+            ret = self._reconnect(node, user, timeout)
+        if not ret:
+            self.logger.critical("Unable to connect to %s" % node)
+        else:
+            self.logger.debug("Connection re-established to %s" % node)
+        return ret
+
+    def recover_connection(self, node, user=''):
+        """
+            To be called when the connection to user@node is found broken.
+
+            If the node is known to be down, fails fast. Otherwise tries to
+            connect once and if that fails too, marks the node down (opens
+            its circuit breaker) and keeps trying to connect in background.
+            Returns True if the connection is re-established and False
+            otherwise
+        """
+        if user == '':
+            user = self.user
+        breaker = self.breakers.setdefault((node, user), CircuitBreaker())
+        if breaker.is_open:
+            self.logger.error("%s@%s is known to be down since %d seconds" \
+                    % (user, node, time.time() - breaker.opened_at))
+            return False
+        if self._reconnect(node, user, 0):
+            return True
+        with self.breaker_lock:
+            if breaker.is_open:
+                return False
+            self.logger.warning("%s@%s is down. Reconnecting in background" \
+                    % (user, node))
+            breaker.opened_at = time.time()
+            breaker.thread = threading.Thread(target=self._reconnect, \
+                    args=(node, user, \
+                    self.global_config.get('reconnect_timeout', 210)))
+            breaker.thread.daemon = True
+            breaker.thread.start()
+        return False
+
+    def wait_until_reachable(self, nodes, user='', timeout=''):
+        """
+            Waits for all the nodes (e.g. after a reboot) to be reachable,
+            probing them in parallel. Nodes whose connection is alive are
+            not reconnected.
+            Returns True if all nodes are reachable within timeout seconds
+            and False otherwise
+        """
+        if user == '':
+            user = self.user
+
+        def probe(node):
+            if self.is_connected(node, user):
+                return True
+            return self.refresh_connection(node, user, timeout)
+
+        status = _parallel_map(probe, nodes, len(nodes))
+        unreachable = [node for node in status if not status[node]]
+        if unreachable:
+            self.logger.error("Nodes %s are not reachable" % unreachable)
+            return False
+        return True
+
+    def is_connected(self, node, user=''):
+        """
+            Returns True if the connection to user@node is alive
         """
         if user == '':
             user = self.user
+        try:
+            conn = self.connection_handles[node][user][2]
+            conn.ping()
+        except:
+            return False
+        return True
+
+    def _reconnect(self, node, user, timeout):
+        """
+            Closes the connection to user@node and connects again. Retries
+            with exponential backoff (with jitter) for at most timeout
+            seconds. Returns True if connected and False otherwise
+        """
+        breaker = self.breakers.setdefault((node, user), CircuitBreaker())
+        self.conn_pool.discard(node, user)
         try:
             self.connection_handles[node][user][2].close()
             self.connection_handles[node][user][1].close()
             self.connection_handles[node][user][0].close()
         except:
             pass
-        while timeout >= 0:
-            try:
-                self.establish_connection(node, user)
-                break
-            except:
-                self.logger.debug("Couldn't connect to %s. Retrying in 42 "
-                                  "seconds" % node)
-                time.sleep(42)
-                timeout = timeout - 42
-        if timeout < 0:
-            self.logger.critical("Unable to connect to %s" % node)
-            return False
-        else:
-            self.logger.debug("Connection re-established to %s" % node)
-            return True
+        deadline = time.time() + timeout
+        delay = 1
+        max_delay = self.global_config.get('reconnect_backoff_max', 32)
+        while True:
+            if self.establish_connection(node, user):
+                breaker.failures = 0
+                return True
+            breaker.failures = breaker.failures + 1
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            sleep_time = min(remaining, random.uniform(delay / 2.0, delay))
+            self.logger.debug("Couldn't connect to %s. Retrying in %.1f "
+                              "seconds" % (node, sleep_time))
+            time.sleep(sleep_time)
+            delay = min(delay * 2, max_delay)
 
-    def run(self, node, cmd, user='', verbose=True):
+    def run(self, node, cmd, user='', verbose=True, timeout=''):
         """
             Run the specified command in specified remote machine
 
+            If the command does not complete within timeout seconds
+            (defaults to 'command_timeout' from config, no timeout if not
+            set), it is killed along with its children.
+
+            Identical gluster queries (see GLUSTER_QUERY) run at the same
+            time on the same node, by different threads, are run only once
+            and all of them get the same result (unless 'coalesce_queries'
+            is False in config). A query is not shared across a command
+            which may change the cluster state (see check_mutation).
+
             Returns a tuple of (retcode, stdout, stderr) of the command
-            in remote machine
+            in remote machine. retcode is TIMEOUT_RETCODE on timeout.
         """
         if user == '':
             user = self.user
+        if timeout == '':
+            timeout = self.global_config.get('command_timeout')
+        if not self.global_config.get('coalesce_queries', True) \
+                or not GLUSTER_QUERY.match(cmd):
+            return self._run(node, cmd, user, verbose, timeout)
+        # A query started before a mutation (which bumps the generation of
+        # the query cache) is not joined by the callers after it
+        key = (node, user, cmd, self.query_cache.generation)
+        with self.inflight_lock:
+            shared = self.inflight.get(key)
+            if shared is None:
+                self.inflight[key] = SharedCall()
+        if shared is not None:
+            self.logger.info("\"%s\" is already running on %s. Waiting for "
+                             "its result" % (cmd, node))
+            started = time.time()
+            result = shared.wait()
+            self.stats.record('run_coalesced', node, find_caller(), \
+                    time.time() - started)
+            return result
+        shared = self.inflight[key]
+        try:
+            shared.result = self._run(node, cmd, user, verbose, timeout)
+        finally:
+            with self.inflight_lock:
+                del self.inflight[key]
+            shared.event.set()
+        return shared.result
+
+    def _run(self, node, cmd, user, verbose, timeout):
+        """
+            run, without the coalescing of queries
+
+            If volumes are set up or cleaned up in the background (by the
+            volume pool or the pipelined setup), the gluster CLI commands
+            which change the cluster state are run one at a time (under
+            gluster_lock), so that the commands of the background threads
+            and of the testcase do not fail on the transaction lock of
+            glusterd. gluster commands failing on that lock anyway (taken by
+            others) are retried, at most 'gluster_busy_retries' times from
+            config (5 by default). Otherwise the commands are run as they
+            are, concurrently if so called.
+        """
+        if not self.serialise_gluster or not GLUSTER_CLI.match(cmd):
+            return self._run_once(node, cmd, user, verbose, timeout)
+        mutation = not GLUSTER_QUERY.match(cmd)
+        retries = self.global_config.get('gluster_busy_retries', 5)
+        delay = 1
+        for attempt in range(retries + 1):
+            if mutation:
+                with self.gluster_lock:
+                    ret = self._run_once(node, cmd, user, verbose, timeout)
+            else:
+                ret = self._run_once(node, cmd, user, verbose, timeout)
+            if attempt == retries or not self._gluster_busy(cmd, ret):
+                return ret
+            delay = self._wait_busy(cmd, node, delay)
+        return ret
+
+    def _gluster_busy(self, cmd, ret):
+        """
+            Tells if the gluster command cmd failed (with the result ret) as
+            glusterd was busy with another transaction
+        """
+        return GLUSTER_CLI.match(cmd) is not None and \
+                ret[0] not in (0, -1) and \
+                GLUSTER_BUSY.search("%s%s" % (ret[1], ret[2])) is not None
+
+    def _wait_busy(self, cmd, node, delay):
+        """
+            Waits delay seconds before retrying cmd, which failed as
+            glusterd was busy. Returns the delay before the next retry.
+        """
+        self.logger.warning("\"%s\" on %s failed as glusterd is busy with "
+                            "another transaction. Retrying in %d seconds" \
+                            % (cmd, node, delay))
+        time.sleep(delay)
+        return min(delay * 2, 16)
+
+    def _run_once(self, node, cmd, user, verbose, timeout):
+        """
+            _run, without the serialising and retrying of gluster commands
+        """
+        if threading.current_thread().name != 'MainThread':
+            # The main connection serves one request at a time. So commands
+            # from other threads go through pooled connections, instead of
+            # waiting behind the commands of the main thread.
+            handle = self.arun(node, cmd, user, timeout, verbose)
+            if handle is None:
+                return (-1, -1, -1)
+            return handle.value()
+        started = time.time()
+        self.ensure_connection(node, user)
+        self.check_mutation(cmd)
         self.logger.info("Executing %s on %s" % (cmd, node))
         try:
             subp = self.subp_conn[node][user]
             p = subp.Popen(cmd, shell=True, stdout=subp.PIPE, stderr=subp.PIPE)
         except:
-            ret = self.refresh_connection(node, user)
+            ret = self.recover_connection(node, user)
             if not ret:
                 self.logger.critical("Unable to connect to %s@%s" \
                         % (user, node))
                 return (-1, -1, -1)
             subp = self.subp_conn[node][user]
             p = subp.Popen(cmd, shell=True, stdout=subp.PIPE, stderr=subp.PIPE)
-        pout, perr = p.communicate()
-        ret = p.returncode
-        self.logger.info("\"%s\" on %s: RETCODE is %d" % (cmd, node, ret))
-        if pout != "" and verbose:
-            self.logger.info("\"%s\" on %s: STDOUT is \n %s" % \
-                            (cmd, node, pout))
-        if perr != "" and verbose:
-            self.logger.error("\"%s\" on %s: STDERR is \n %s" % \
-                            (cmd, node, perr))
+        if timeout:
+            ret, pout, perr = AsyncCommand(self, node, user, cmd, \
+                    self.connection_handles[node][user][2], p, timeout, \
+                    log=False).value()
+        else:
+            pout, perr = p.communicate()
+            ret = p.returncode
+        self.check_mutation(cmd)
+        self.stats.record('run', node, find_caller(), time.time() - started, \
+                len(cmd) + len(pout) + len(perr))
+        self.log_output(cmd, node, ret, pout, perr, verbose)
         return (ret, pout, perr)
 
-    def run_async(self, node, cmd, user='', verbose=True):
+    def run_cached(self, node, cmd, user='', verbose=True):
+        """
+            Same as run, but for read-only queries like gluster volume info.
+            Successful results are cached for 'query_cache_ttl' seconds from
+            config (30 by default, 0 disables caching).
+
+            The cache is cleared whenever a command which may change the
+            cluster state is run through BigBang (see check_mutation). So
+            the repeated lookups of a testcase cost nothing, while a lookup
+            after a change never sees the stale result.
+        """
+        if user == '':
+            user = self.user
+        key = (node, user, cmd)
+        result = self.query_cache.get(key)
+        if result is not None:
+            self.logger.debug("Using the cached result of \"%s\" on %s" \
+                    % (cmd, node))
+            self.stats.record('run_cached', node, find_caller(), 0)
+            return result
+        generation = self.query_cache.generation
+        result = self.run(node, cmd, user, verbose)
+        if result[0] == 0:
+            self.query_cache.put(key, result, generation)
+        return result
+
+    def check_mutation(self, cmd):
+        """
+            Invalidates the cached query results if cmd may change the
+            cluster state, i.e. it mentions gluster and is not a query
+            matched by GLUSTER_QUERY, or it is matched by STATE_CHANGE.
+            Called before and after such commands.
+            Testcases changing the cluster state by other means, should call
+            query_cache.invalidate() themselves.
+        """
+        if ('gluster' in cmd and not GLUSTER_QUERY.match(cmd)) \
+                or STATE_CHANGE.search(cmd):
+            self.query_cache.invalidate()
+
+    def log_output(self, cmd, node, retc, pout, perr, verbose=True, \
+            out_level=logging.INFO):
+        """
+            Logs the retcode and, if verbose, the stdout (at out_level) and
+            stderr of the cmd run in node. Outputs longer than
+            log_output_limit are truncated, with the full output written
+            to a file in artifact_dir/<testcase name>/
+        """
+        self.logger.info("\"%s\" on %s: RETCODE is %d" % (cmd, node, retc))
+        if not verbose:
+            return
+        limit = self.log_output_limit
+        for name, output, level in (('STDOUT', pout, out_level), \
+                                    ('STDERR', perr, logging.ERROR)):
+            if output == "":
+                continue
+            if not limit or len(output) <= limit:
+                self.logger.log(level, "\"%s\" on %s: %s is \n %s" \
+                        % (cmd, node, name, output))
+                continue
+            path = os.path.join(self.artifact_dir, \
+                    self.current_test or 'global', "%05d_%s.%s" \
+                    % (next(self.artifact_seq), node, name.lower()))
+            self.logger.log(level, "\"%s\" on %s: %s is (first %d of %d "
+                            "bytes, full output in %s) \n %s" \
+                            % (cmd, node, name, limit, len(output), path, \
+                               output[:limit]), \
+                            extra={'artifact_path': path, \
+                                   'artifact_data': output})
+
+    def start_test_log(self, name):
+        """
+            Starts logging to the per testcase log file
+            test_log_dir/<name>.log (if test_log_dir is set in config),
+            in addition to the main log file. The log file of the
+            previous testcase is closed.
+        """
+        self.end_test_log()
+        self.current_test = name
+        test_log_dir = self.global_config.get('test_log_dir')
+        if not test_log_dir:
+            return
+        if not os.path.isdir(test_log_dir):
+            os.makedirs(test_log_dir)
+        # delay, so that the file is opened by the thread writing to it
+        self.test_lhndlr = logging.FileHandler(os.path.join(test_log_dir, \
+                "%s.log" % name), delay=True)
+        self.test_lhndlr.setFormatter(self.lhndlr.formatter)
+        if self.log_listener is not None:
+            self.log_listener.add_handler(self.test_lhndlr)
+        else:
+            self.logger.addHandler(self.test_lhndlr)
+
+    def end_test_log(self):
+        """
+            Closes the log file of the current testcase
+        """
+        self.current_test = None
+        if self.test_lhndlr is None:
+            return
+        if self.log_listener is not None:
+            self.log_listener.remove_handler(self.test_lhndlr)
+        else:
+            self.logger.removeHandler(self.test_lhndlr)
+            self.test_lhndlr.close()
+        self.test_lhndlr = None
+
+    def run_batch(self, node, cmds, user='', stop_on_failure=True, \
+            verbose=True):
+        """
+            Run the list of commands in specified remote node one after the
+            other, in a single round trip over the network (through the
+            remote_agent).
+            If stop_on_failure is True, the commands after the first failed
+            command are not run.
+
+            As in run, when gluster commands are serialised, the batch is
+            retried from the first gluster command which failed as glusterd
+            was busy with another transaction.
+
+            Returns a list of tuple of (retcode, stdout, stderr) of each
+            command run. Returns None if unable to connect to the node.
+        """
+        if user == '':
+            user = self.user
+        self.logger.info("Executing batch of %d commands on %s: %s" \
+                % (len(cmds), node, cmds))
+        for cmd in cmds:
+            self.check_mutation(cmd)
+        # Serialised with the other gluster commands changing the cluster
+        # state, as in run
+        serialise = self.serialise_gluster and \
+                any([GLUSTER_CLI.match(cmd) is not None and \
+                GLUSTER_QUERY.match(cmd) is None for cmd in cmds])
+        retries = 0
+        if self.serialise_gluster:
+            retries = self.global_config.get('gluster_busy_retries', 5)
+        results = []
+        pending = list(cmds)
+        delay = 1
+        for attempt in range(retries + 1):
+            if serialise:
+                self.gluster_lock.acquire()
+            try:
+                ret = self.call_agent(node, 'run_batch', \
+                        (pending, stop_on_failure), user)
+            finally:
+                if serialise:
+                    self.gluster_lock.release()
+            if ret is None:
+                results = None
+                break
+            busy = [i for i, (cmd, result) in enumerate(zip(pending, ret)) \
+                    if self._gluster_busy(cmd, result)]
+            if attempt == retries or not busy:
+                results.extend(ret)
+                break
+            results.extend(ret[:busy[0]])
+            pending = pending[busy[0]:]
+            delay = self._wait_busy(pending[0], node, delay)
+        for cmd in cmds:
+            self.check_mutation(cmd)
+        if results is None:
+            return None
+        for cmd, (ret, pout, perr) in zip(cmds, results):
+            self.log_output(cmd, node, ret, pout, perr, verbose)
+        return results
+
+    def run_stream(self, node, cmd, user='', chunk_size=65536):
+        """
+            Run the specified command in specified remote node and return
+            a RemoteStream of its stdout. This is for commands with huge
+            outputs, which can be parsed as and when the output arrives
+            instead of holding the whole of it in memory.
+
+            Returns None if the connection to the node could not be made
+        """
+        if user == '':
+            user = self.user
+        started = time.time()
+        caller = find_caller()
+        conn = self.get_connection(node, user)
+        if conn == -1:
+            return None
+        self.check_mutation(cmd)
+        self.logger.info("Executing %s on %s (streaming output)" % (cmd, node))
+        subp = conn.modules.subprocess
+        errfile = conn.modules.tempfile.TemporaryFile()
+        p = subp.Popen(cmd, shell=True, stdout=subp.PIPE, stderr=errfile)
+
+        def on_close(stream):
+            self.put_connection(conn)
+            self.check_mutation(cmd)
+            self.stats.record('run_stream', node, caller, \
+                    time.time() - started, \
+                    len(cmd) + stream.nbytes + len(stream.stderr))
+            self.logger.info("\"%s\" on %s: RETCODE is %d. Streamed %d bytes" \
+                    % (cmd, node, stream.returncode, stream.nbytes))
+            if stream.stderr != "":
+                self.logger.error("\"%s\" on %s: STDERR is \n %s" % \
+                        (cmd, node, stream.stderr))
+
+        return RemoteStream(conn, p, errfile, chunk_size, on_close)
+
+    def run_spooled(self, node, cmd, user='', max_size=''):
+        """
+            Run the specified command in specified remote node and spool its
+            stdout to a local temporary file. The output stays in memory
+            till it grows beyond max_size bytes and is then spilled to disk.
+            max_size defaults to 'stream_spool_size' from config (or 8MB).
+
+            Returns a tuple of (retcode, stdout file object, stderr).
+            The file object is positioned at the beginning of the output.
+        """
+        if max_size == '':
+            max_size = self.global_config.get('stream_spool_size', 8388608)
+        stream = self.run_stream(node, cmd, user)
+        if stream is None:
+            return (-1, -1, -1)
+        pout = tempfile.SpooledTemporaryFile(max_size=max_size)
+        for chunk in stream.chunks():
+            pout.write(chunk)
+        pout.seek(0)
+        return (stream.returncode, pout, stream.stderr)
+
+    def run_async(self, node, cmd, user='', verbose=True, timeout=''):
         """
             Run the specified command in specified remote node asynchronously
+
+            Returns the (remote) Popen object of the command, with a value()
+            function which returns the tuple of (retcode, stdout, stderr).
+            See arun for timeout. Returns None on connection failure.
+        """
+        handle = self.arun(node, cmd, user, timeout, verbose)
+        if handle is None:
+            return None
+        p = handle.popen
+        p.value = handle.value
+        p.close = handle.close
+        return p
+
+    def arun(self, node, cmd, user='', timeout='', verbose=True):
+        """
+            Start the specified command in specified remote node without
+            waiting for it. The command is killed if it does not complete
+            within timeout seconds (defaults to 'command_timeout' from
+            config, no timeout if not set).
+
+            Returns an AsyncCommand, whose value() is the tuple of
+            (retcode, stdout, stderr). Returns None if the connection to
+            the node could not be made.
         """
         if user == '':
             user = self.user
-        try:
-            c = self.connection_handles[node][user][1].classic_connect()
-        except:
-            ret = self.refresh_connection(node, user)
-            if not ret:
-                self.logger.critical("Couldn't connect to %s" % node)
-                return None
-            c = self.connection_handles[node][user][1].classic_connect()
+        if timeout == '':
+            timeout = self.global_config.get('command_timeout')
+        conn = self.get_connection(node, user)
+        if conn == -1:
+            return None
+        self.check_mutation(cmd)
         self.logger.info("Executing %s on %s asynchronously" % (cmd, node))
-        p = c.modules.subprocess.Popen(cmd, shell=True, \
-            stdout=c.modules.subprocess.PIPE, stderr=c.modules.subprocess.PIPE)
+        subp = conn.modules.subprocess
+        p = subp.Popen(cmd, shell=True, stdout=subp.PIPE, stderr=subp.PIPE)
+        return AsyncCommand(self, node, user, cmd, conn, p, timeout, verbose)
 
-        def value():
-            """
-                A function which returns the tuple of (retcode, stdout, stdin)
-            """
-            pout, perr = p.communicate()
-            retc = p.returncode
-            c.close()
-            self.logger.info("\"%s\" on \"%s\": RETCODE is %d" % \
-            (cmd, node, retc))
-            if pout != "" and verbose:
-                self.logger.debug("\"%s\" on \"%s\": STDOUT is \n %s" % \
-                (cmd, node, pout))
-            if perr != "" and verbose:
-                self.logger.error("\"%s\" on \"%s\": STDERR is \n %s" % \
-                (cmd, node, perr))
-            return (retc, pout, perr)
-
-        p.value = value
-        p.close = lambda: c.close()
-        return p
+    def gather(self, commands):
+        """
+            Waits for all the AsyncCommands (from arun) to complete.
+
+            Returns the list of (retcode, stdout, stderr) in the same order
+            as commands. (-1, -1, -1) is returned for commands which could
+            not be started (i.e. None in commands)
+        """
+        results = []
+        for command in commands:
+            if command is None:
+                results.append((-1, -1, -1))
+            else:
+                results.append(command.value())
+        return results
+
+    def kill_remote(self, node, pid, user='', sig=9):
+        """
+            Sends the signal sig (SIGKILL by default) to the process pid and
+            all its descendants in the remote node. A connection from the
+            pool is used, so that this works even when the connection
+            which started the process is busy waiting for it.
+
+            Returns True on success and False otherwise
+        """
+        if user == '':
+            user = self.user
+        # Children are listed before the parent is killed, as they get
+        # re-parented to init once the parent is gone
+        cmd = "kill_tree() { children=$(pgrep -P $1); " \
+              "kill -%d $1 2>/dev/null; " \
+              "for child in $children; do kill_tree $child; done; }; " \
+              "kill_tree %d" % (sig, pid)
+        conn = self.get_connection(node, user)
+        if conn == -1:
+            self.logger.error("Unable to kill the process %s in %s" \
+                    % (pid, node))
+            return False
+        self.logger.info("Killing the process %s and its children in %s" \
+                % (pid, node))
+        ret = conn.modules.subprocess.call(cmd, shell=True)
+        self.put_connection(conn)
+        return ret == 0
+
+    def run_parallel(self, commands, user='', max_workers='', \
+            cancel_on_failure=False, verbose=True, timeout=''):
+        """
+            Run the commands in parallel, where commands is a dict of node
+            to the command to be run in that node.
+
+            At most max_workers (defaults to 'max_parallel_commands' from
+            config or 32) commands are in flight at a time. Results are
+            collected in the order of completion. If cancel_on_failure is
+            True, the first failure kills the commands still running and
+            the commands yet to be started are not run at all. Commands
+            running longer than timeout (see arun) are killed and their
+            retcode is TIMEOUT_RETCODE.
+
+            Returns a dict of node to the tuple of
+            (retcode, stdout, stderr, duration) of the commands which were
+            run. retcode is -1 if the node could not be connected to.
+        """
+        if user == '':
+            user = self.user
+        if max_workers == '':
+            max_workers = self.global_config.get('max_parallel_commands', 32)
+        pending = list(commands.items())
+        inflight = {}
+        results = {}
+        failed = False
+        while pending or inflight:
+            while pending and len(inflight) < max_workers and not failed:
+                node, cmd = pending.pop(0)
+                handle = self.arun(node, cmd, user, timeout, verbose)
+                if handle is None:
+                    results[node] = (-1, -1, -1, 0)
+                    failed = cancel_on_failure
+                else:
+                    inflight[node] = handle
+            if failed and pending:
+                self.logger.error("Not running the command on %s, as it "
+                                  "failed on other node(s)" \
+                                  % [node for node, _ in pending])
+                pending = []
+            if not inflight:
+                continue
+            select.select([handle.conn for handle in inflight.values()], \
+                    [], [], 1)
+            for node, handle in list(inflight.items()):
+                if not handle.done:
+                    continue
+                del inflight[node]
+                retc, pout, perr = handle.value()
+                results[node] = (retc, pout, perr, handle.duration)
+                if retc != 0 and cancel_on_failure and not failed:
+                    failed = True
+                    self.logger.error("\"%s\" failed on %s. Cancelling it "
+                                      "on other node(s)" % (handle.cmd, node))
+                    for other in inflight.values():
+                        other.cancel()
+        return results
 
-    def run_servers(self, command, user='', servers='', verbose=True):
+    def run_servers(self, command, user='', servers='', verbose=True, \
+            max_workers='', cancel_on_failure=False, timeout=''):
         """
-            Run the specified command in each of the server in parallel
+            Run the specified command in each of the server in parallel.
+            See run_parallel for max_workers, cancel_on_failure and timeout.
+
+            Returns a tuple of (True/False, dict of server to the tuple of
+            (retcode, stdout, stderr, duration)). The first value is True
+            only if the command succeeded in all the servers.
         """
         if user == '':
             user = self.user
         if servers == '':
             servers = self.nodes
-        servers = list(set(servers))
-        sdict = {}
-        out_dict = {}
-        ret = True
-        for server in servers:
-            sdict[server] = self.run_async(server, command, user, verbose)
-        for server in servers:
-            sdict[server].wait()
-            ps, _, _ = sdict[server].value()
-            out_dict[server] = ps
-            if 0 != ps:
-                ret = False
+        if timeout == '':
+            timeout = self.global_config.get('command_timeout')
+        threshold = self.global_config.get('tree_fanout_threshold', 0)
+        if threshold and len(set(servers)) >= threshold \
+                and not cancel_on_failure and not timeout:
+            out_dict = self.run_tree(command, servers, user, verbose)
+        else:
+            commands = dict([(server, command) for server in set(servers)])
+            out_dict = self.run_parallel(commands, user, max_workers, \
+                    cancel_on_failure, verbose, timeout)
+        ret = len(out_dict) == len(set(servers)) and \
+                all([out[0] == 0 for out in out_dict.values()])
         return (ret, out_dict)
 
+    def run_tree(self, command, servers, user='', verbose=True):
+        """
+            Run the specified command in each of the servers through
+            relays, for clusters too big to fan out from this node alone.
+
+            About sqrt(len(servers)) of the already connected servers are
+            picked as relays. Each relay runs the command itself and, over
+            ssh, in its share of the other servers, and sends back all the
+            results in one reply. This needs passwordless ssh from the
+            relays to the servers. Servers which the relay could not ssh
+            to, are run from this node directly.
+
+            Returns a dict of server to the tuple of
+            (retcode, stdout, stderr, duration)
+        """
+        if user == '':
+            user = self.user
+        servers = sorted(set(servers))
+        connected = [server for server in servers \
+                if user in self.connection_handles.get(server, {})]
+        nrelays = int(math.ceil(math.sqrt(len(servers))))
+        relays = connected[:nrelays]
+        if not relays:
+            return self.run_parallel(dict([(server, command) \
+                    for server in servers]), user, verbose=verbose)
+        shares = dict([(relay, []) for relay in relays])
+        others = [server for server in servers if server not in relays]
+        for i, server in enumerate(others):
+            shares[relays[i % len(relays)]].append(server)
+        ssh_options = self.global_config.get('relay_ssh_options', \
+                ['-o', 'StrictHostKeyChecking=no'])
+        self.logger.info("Executing %s on %d servers through relays %s" \
+                % (command, len(servers), relays))
+
+        # The relays are called from other threads
+        caller = find_caller()
+
+        def relay_run(relay):
+            try:
+                return self._call_agent(relay, 'relay_run', \
+                        (command, shares[relay], user, ssh_options), user, \
+                        caller)
+            except Exception:
+                self.logger.exception("Unable to run %s through the relay "
+                                      "%s" % (command, relay))
+                return None
+
+        self.check_mutation(command)
+        replies = _parallel_map(relay_run, relays, len(relays))
+        self.check_mutation(command)
+        results = {}
+        direct = []
+        for relay in relays:
+            if replies.get(relay) is None:
+                direct.extend([relay] + shares[relay])
+                continue
+            for server, result in replies[relay].items():
+                if server is None:
+                    server = relay
+                if result[0] == 255 and server != relay:
+                    direct.append(server)
+                else:
+                    results[server] = result
+        for server in sorted(results):
+            ret, pout, perr, duration = results[server]
+            self.stats.record('run_tree', server, caller, duration, \
+                    len(command) + len(pout) + len(perr))
+            self.log_output(command, server, ret, pout, perr, verbose)
+        if direct:
+            self.logger.warning("Relays could not reach %s. Running on them "
+                                "directly" % direct)
+            results.update(self.run_parallel(dict([(server, command) \
+                    for server in direct]), user, verbose=verbose))
+        return results
+
     def get_connection(self, node, user=''):
         """
-            Establishes a connection to the remote node and returns
-            the connection handle. Returns -1 if connection couldn't
-            be established.
+            Checks out a connection to the remote node from the connection
+            pool and returns the connection handle. Returns -1 if connection
+            couldn't be established.
+
+            The connection should be returned with put_connection once done.
+            Closing it instead is also fine, but it can not be reused then.
         """
         if user == '':
             user = self.user
+        started = time.time()
+        self.ensure_connection(node, user)
         try:
-            conn = self.connection_handles[node][user][1].classic_connect()
+            conn = self.conn_pool.checkout(node, user, \
+                    self.connection_handles[node][user][1])
         except:
-            ret = self.refresh_connection(node, user)
+            ret = self.recover_connection(node, user)
             if not ret:
                 self.logger.critical("Couldn't connect to %s" % node)
                 return -1
-            conn = self.connection_handles[node][user][1].classic_connect()
+            conn = self.conn_pool.checkout(node, user, \
+                    self.connection_handles[node][user][1])
+        self.stats.record('get_connection', node, find_caller(), \
+                time.time() - started)
         return conn
 
+    def put_connection(self, conn):
+        """
+            Returns the connection obtained from get_connection back to the
+            connection pool, so that it can be reused.
+        """
+        self.conn_pool.checkin(conn)
+
     def upload(self, node, localpath, remotepath, user=''):
         """
             Uploads the file/directory in localpath to file/directory to
@@ -244,8 +1495,18 @@ class BigBang():
         """
         if user == '':
             user = self.user
+        started = time.time()
+        self.ensure_connection(node, user)
         rem = self.connection_handles[node][user][0]
         rem.upload(localpath, remotepath)
+        nbytes = 0
+        for top, _, files in os.walk(localpath):
+            nbytes += sum([os.path.getsize(os.path.join(top, _f)) \
+                    for _f in files])
+        if os.path.isfile(localpath):
+            nbytes = os.path.getsize(localpath)
+        self.stats.record('upload', node, find_caller(), \
+                time.time() - started, nbytes)
         return None
 
     def add_group(self, node, group):
@@ -254,6 +1515,7 @@ class BigBang():
 
             Returns True on success and False on failure
         """
+        self.ensure_connection(node)
         if 'root' not in self.connection_handles[node]:
             self.logger.error("ssh connection to 'root' of %s is not present" \
                     % node)
@@ -265,12 +1527,12 @@ class BigBang():
         try:
             conn.modules.grp.getgrnam(group)
             self.logger.debug("Group %s already exists on %s" % (group, node))
-            conn.close()
+            self.put_connection(conn)
             return True
         except KeyError:
             self.logger.debug("group %s does not exist in %s. Creating now" \
                     % (group, node))
-            conn.close()
+            self.put_connection(conn)
         ret = self.run(node, "groupadd %s" % group)
         if ret[0] != 0:
             self.logger.error("Unable to add group %s to %s" % (group, node))
@@ -289,6 +1551,7 @@ class BigBang():
             And then it connects to remote user and updates the
             dict of connection_handles
         """
+        self.ensure_connection(node)
         if 'root' not in self.connection_handles[node]:
             self.logger.error("ssh connection to 'root' of %s is not present" \
                     % node)
@@ -301,6 +1564,7 @@ class BigBang():
         try:
             conn.modules.pwd.getpwnam(user)
             self.logger.debug("User %s already exist in %s" % (user, node))
+            self.put_connection(conn)
             return True
         except KeyError:
             self.logger.debug("User %s doesn't exist in %s. Creating now" \
@@ -336,7 +1600,7 @@ class BigBang():
                     % (user, node))
             return False
         rfh.close()
-        conn.close()
+        self.put_connection(conn)
         ret = self.establish_connection(node, user)
         if not ret:
             self.logger.critical("Unable to connect to %s@%s" % (user, node))
@@ -347,10 +1611,20 @@ class BigBang():
         """
             Destroy all stored connections to user@remote-machine
         """
+        self.conn_pool.close_all()
         for node in self.connection_handles.keys():
             for user in self.connection_handles[node].keys():
                 self.logger.debug("Closing all connection to %s@%s" \
                         % (user, node))
+                try:
+                    conn = self.connection_handles[node][user][2]
+                    conn.modules.shutil.rmtree(conn.modules.os.path.dirname( \
+                            self.agents[node][user].__file__), True)
+                except:
+                    pass
                 self.connection_handles[node][user][2].close()
                 self.connection_handles[node][user][1].close()
                 self.connection_handles[node][user][0].close()
+        self.end_test_log()
+        if self.log_listener is not None:
+            self.log_listener.stop()
@@ -16,9 +16,11 @@
 #  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 
-from distaf.util import tc
+from distaf.util import tc, test_seq, test_configs
 from distaf.mount_ops import umount_volume
-from distaf.volume_ops import setup_vol, get_volume_info, cleanup_volume
+from distaf.volume_ops import setup_vol, get_volume_info, cleanup_volume, \
+        get_voltype_params
+from distaf.volume_pool import get_pool
 
 class DistafTestClass():
     """
@@ -53,13 +55,35 @@ class DistafTestClass():
             self.mountpoint = "/mnt/%s_mount" % self.mount_proto
         self.mnode = self.nodes[0]
         self.config_data = config_data
+        self.pool = None
 
     def setup(self):
         """
             Function to setup the volume for testing.
+
+            Testcases which do not reuse the setup, get a ready volume from
+            the volume pool, if 'volume_pool_size' is set in config.
         """
+        if not self.config_data['global_mode'] and \
+                not self.config_data['reuse_setup']:
+            # Only the volumes of the tests not reusing the setup are
+            # checked out of the pool
+            voltypes = [self.voltype]
+            for voltype, _, test in test_seq:
+                config = test_configs.get(test)
+                if config is not None and not config['reuse_setup'] and \
+                        voltype not in voltypes:
+                    voltypes.append(voltype)
+            pool = get_pool(self.config_data, voltypes)
+            volname = None
+            if pool is not None:
+                volname = pool.checkout(self.voltype)
+            if volname is not None:
+                self.volname = volname
+                self.pool = pool
+                return True
         volinfo = get_volume_info(server=self.nodes[0])
-        if volinfo is not None and self.volname in volinfo.keys():
+        if volinfo is not None and self.volname in volinfo:
             tc.logger.debug("The volume %s is already present in %s" \
                     % (self.volname, self.mnode))
             if not self.config_data['reuse_setup']:
@@ -68,32 +92,11 @@ class DistafTestClass():
                     tc.logger.error("Unable to cleanup the setup")
                     return False
         else:
-            dist = rep = dispd = red = stripe = 1
-            trans = ''
-            if self.voltype == 'distribute':
-                dist = self.config_data[self.voltype]['dist_count']
-                trans = self.config_data[self.voltype]['transport']
-            elif self.voltype == 'replicate':
-                rep = self.config_data[self.voltype]['replica']
-                trans = self.config_data[self.voltype]['transport']
-            elif self.voltype == 'dist_rep':
-                dist = self.config_data[self.voltype]['dist_count']
-                rep = self.config_data[self.voltype]['replica']
-                trans = self.config_data[self.voltype]['transport']
-            elif self.voltype == 'disperse':
-                dispd = self.config_data[self.voltype]['disperse']
-                red = self.config_data[self.voltype]['redundancy']
-                trans = self.config_data[self.voltype]['transport']
-            elif self.voltype == 'dist_disperse':
-                dist = self.config_data[self.voltype]['dist_count']
-                dispd = self.config_data[self.voltype]['disperse']
-                red = self.config_data[self.voltype]['redundancy']
-                trans = self.config_data[self.voltype]['transport']
-            else:
+            params = get_voltype_params(self.voltype, self.config_data)
+            if params is None:
                 tc.logger.error("The volume type is not present")
                 return False
-            ret = setup_vol(self.volname, dist, rep, dispd, red, \
-                            stripe, trans, servers=self.nodes)
+            ret = setup_vol(self.volname, *params, servers=self.nodes)
             if not ret:
                 tc.logger.error("Unable to setup volume %s. Aborting" \
                         % self.volname)
@@ -105,10 +108,15 @@ class DistafTestClass():
             The function to cleanup the test setup
         """
         #umount_volume(self.clients[0], self.mountpoint)
+        if self.pool is not None:
+            self.pool.checkin(self.volname, self.voltype)
         return True
 
     def cleanup(self):
         """
             The function to cleanup the volume
         """
+        if self.pool is not None:
+            # The volume is back in the pool, which cleans it up
+            return True
         return cleanup_volume(self.volname, self.mnode)
@@ -22,6 +22,7 @@ Description: Library for file operations.
 
 
 from distaf.util import tc
+import os
 import re
 import socket
 
@@ -48,45 +49,18 @@ def write_file(filename, file_contents=" ", create_mode='', filesize='', \
         create_mode = 'open'
 
     if create_mode != 'open':
-        try:
-            conn = tc.get_connection(server, 'root')
-            if conn == -1:
-                tc.logger.error("Unable to get connection to 'root' of "
-                                "node %s" % server)
-                return False
-            if not conn.modules.os.path.exists(conn.modules.os.path.\
-                    dirname(filename)):
-                conn.modules.os.makedirs(conn.modules.os.path.\
-                        dirname(filename))
-        except:
+        ret = create_dirs([os.path.dirname(filename)], server)
+        if not ret:
             tc.logger.error("Exception occured while creating directory  for "
                             "file %s" % filename)
             return False
-        finally:
-            conn.close()
 
     if create_mode == 'open':
-        try:
-            conn = tc.get_connection(server, 'root')
-            if conn == -1:
-                tc.logger.error("Unable to get connection to 'root' of node "
-                                "%s" % server)
-                return False
-
-            if not conn.modules.os.path.exists(conn.modules.os.path.\
-                    dirname(filename)):
-                conn.modules.os.makedirs(conn.modules.os.path.\
-                        dirname(filename))
-
-            with conn.builtin.open(filename, 'w') as _filehandle:
-                _filehandle.write(file_contents)
-        except:
+        ret = write_files({filename: file_contents}, server)
+        if not ret:
             tc.logger.error("Exception occured while writing file %s" \
                     % filename)
             return False
-
-        finally:
-            conn.close()
     elif create_mode == 'echo':
         cmd = "echo " + file_contents + " > " + filename
         ret, _, _ = tc.run(server, cmd)
@@ -124,24 +98,98 @@ def remove_file(filename, server=''):
     """
     if server == '':
         server = tc.nodes[0]
-    try:
-        conn = tc.get_connection(server, 'root')
-        if conn == -1:
-            tc.logger.error("Unable to get connection to 'root' of node %s" \
-                            % server)
-            return False
-        if conn.modules.os.path.exists(filename):
-            conn.modules.os.remove(filename)
-    except:
+    if not remove_files([filename], server):
         tc.logger.error("Exception occured while removing file %s" % filename)
         return False
 
-    finally:
-        conn.close()
-
     return True
 
 
+def _agent_op(func, args, server):
+    """
+        Runs the remote_agent function func in the server as 'root' and
+        logs the paths for which it failed.
+        Returns the dict returned by func or None if unable to run it
+    """
+    result = tc.call_agent(server, func, args, user='root')
+    if result is None:
+        tc.logger.error("Unable to run %s in 'root' of node %s" \
+                % (func, server))
+        return None
+    for path, ret in result.items():
+        if isinstance(ret, str):
+            tc.logger.error("%s failed for %s in %s: %s" \
+                    % (func, path, server, ret))
+    return result
+
+
+def write_files(files, server=''):
+    """
+    This module writes many files in a single call to the server
+    @paramater:
+        * files    - <dict> absolute path name of the file to its contents.
+                     Parent directories are created if not present
+        * server   - <str> (optional) name of the server to write the
+                     files. If not given, the function takes the
+                     first node from config file
+    @Returns: True, if all the files are written
+              False, on failure
+    """
+    if server == '':
+        server = tc.nodes[0]
+    ret = _agent_op('write_many', (files,), server)
+    return ret is not None and all([val is True for val in ret.values()])
+
+
+def create_dirs(dir_list, server=''):
+    """
+    This module creates many directories (with parents) in a single call
+    @paramater:
+        * dir_list - <list> absolute path names of the directories
+        * server   - <str> (optional) name of the server. If not given,
+                     the function takes the first node from config file
+    @Returns: True, if all the directories are present
+              False, on failure
+    """
+    if server == '':
+        server = tc.nodes[0]
+    ret = _agent_op('makedirs_many', (dir_list,), server)
+    return ret is not None and all([val is True for val in ret.values()])
+
+
+def remove_files(file_list, server=''):
+    """
+    This module removes many files in a single call. Files which do not
+    exist are ignored
+    @paramater:
+        * file_list - <list> absolute path names of the files
+        * server    - <str> (optional) name of the server. If not given,
+                      the function takes the first node from config file
+    @Returns: True, on success
+              False, on failure
+    """
+    if server == '':
+        server = tc.nodes[0]
+    ret = _agent_op('remove_many', (file_list,), server)
+    return ret is not None and all([val is True for val in ret.values()])
+
+
+def stat_files(file_list, server=''):
+    """
+    This module gets the stat of many files in a single call
+    @paramater:
+        * file_list - <list> absolute path names of the files
+        * server    - <str> (optional) name of the server. If not given,
+                      the function takes the first node from config file
+    @Returns: dict of file name to its lstat tuple (None if file does not
+              exist), on success
+              None, on failure
+    """
+    if server == '':
+        server = tc.nodes[0]
+    return _agent_op('stat_many', (file_list,), server)
+
+
 def calculate_checksum(file_list, server=''):
     """
     This module calculates checksum (sha256sum) for the given file list
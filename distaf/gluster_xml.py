@@ -0,0 +1,324 @@
+#  This file is part of DiSTAF
+#  Copyright (C) 2015-2016  Red Hat, Inc. <http://www.redhat.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Parser for the --xml outputs of gluster volume info and
+    gluster volume status.
+
+    The xml is parsed once and the volume elements are indexed by the volume
+    name. A volume element is turned into a compact record (with __slots__)
+    only when it is looked up, so looking up one volume does not convert the
+    elements of all the others.
+
+    The records can also be indexed like the dicts which get_volume_info and
+    get_volume_status used to return, so existing callers keep working.
+    This module does not depend on tc, so that it can be benchmarked alone.
+"""
+
+
+try:
+    import xml.etree.cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+
+
+def element_to_dict(elem):
+    """
+        Returns the dict of the tag to text of each child of elem. Children
+        which have children themselves are converted to dicts recursively.
+    """
+    result = {}
+    for child in elem:
+        if len(child):
+            result[child.tag] = element_to_dict(child)
+        else:
+            result[child.tag] = child.text
+    return result
+
+
+def _texts(elem, tags):
+    """
+        Returns the list of the text of the children of elem with the tags
+    """
+    texts = [None] * len(tags)
+    for child in elem:
+        if child.tag in tags:
+            texts[tags.index(child.tag)] = child.text
+    return texts
+
+
+BRICK_TAGS = ('name', 'hostUuid', 'isArbiter')
+OPTION_TAGS = ('name', 'value')
+
+
+class Brick(object):
+    """
+        A brick of a volume, as in gluster volume info
+    """
+    __slots__ = ('name', 'host_uuid', 'is_arbiter')
+
+    def __init__(self, name, host_uuid=None, is_arbiter=None):
+        self.name = name
+        self.host_uuid = host_uuid
+        self.is_arbiter = is_arbiter == '1'
+
+    def __repr__(self):
+        return "Brick(%r)" % self.name
+
+
+class Option(object):
+    """
+        A volume option which is set (reconfigured), as in gluster volume info
+    """
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def __repr__(self):
+        return "Option(%r, %r)" % (self.name, self.value)
+
+
+class Volume(object):
+    """
+        A volume as in gluster volume info. fields has the text of the
+        other elements, like type, status and replicaCount.
+
+        volume['bricks'] is the list of brick names (hostname:/brick_path)
+        and volume['options'] is the dict of option name to value, like the
+        dict returned by get_volume_info before.
+    """
+    __slots__ = ('name', 'fields', 'bricks', 'options')
+    name_tag = 'name'
+
+    def __init__(self, elem):
+        self.name = None
+        self.fields = {}
+        self.bricks = []
+        self.options = None
+        for child in elem:
+            if child.tag == 'name':
+                self.name = child.text
+            elif child.tag == 'bricks':
+                self.bricks = [Brick(*_texts(brick, BRICK_TAGS)) \
+                        for brick in child]
+            elif child.tag == 'options':
+                self.options = [Option(*_texts(option, OPTION_TAGS)) \
+                        for option in child]
+            else:
+                self.fields[child.tag] = child.text
+
+    def keys(self):
+        keys = list(self.fields.keys()) + ['bricks']
+        if self.options is not None:
+            keys.append('options')
+        return keys
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        if key == 'bricks':
+            return [brick.name for brick in self.bricks]
+        if key == 'options' and self.options is not None:
+            return dict([(option.name, option.value) \
+                    for option in self.options])
+        return self.fields[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return "Volume(%r)" % self.name
+
+
+class ProcessStatus(object):
+    """
+        A brick or a service (like NFS Server or Self-heal Daemon) as in
+        gluster volume status. fields has the text of the other elements,
+        with the ports as a dict.
+    """
+    __slots__ = ('hostname', 'path', 'fields')
+
+    def __init__(self, elem):
+        self.fields = element_to_dict(elem)
+        self.hostname = self.fields.pop('hostname', None)
+        self.path = self.fields.pop('path', None)
+
+    @property
+    def is_brick(self):
+        return self.path is not None and self.path.startswith('/')
+
+    @property
+    def node_name(self):
+        """
+            The key of this process in the dict of get_volume_status, i.e.
+            the hostname for bricks and the path (localhost) for services
+        """
+        if self.is_brick:
+            return self.hostname
+        return self.path
+
+    @property
+    def process_name(self):
+        """
+            The brick path for bricks and the service name for services
+        """
+        if self.is_brick:
+            return self.path
+        return self.hostname
+
+
+class VolumeStatus(object):
+    """
+        A volume as in gluster volume status.
+
+        volume_status[node_name] is the dict of the brick path (or service
+        name) to the dict of its status and volume_status['task_status'] is
+        the list of tasks, like the dict returned by get_volume_status before.
+    """
+    __slots__ = ('name', 'processes', 'tasks')
+    name_tag = 'volName'
+
+    def __init__(self, elem):
+        self.name = elem.findtext('volName')
+        self.processes = [ProcessStatus(node) for node in elem.findall('node')]
+        self.tasks = [element_to_dict(task) \
+                for task in elem.findall('tasks/task')]
+
+    def keys(self):
+        keys = []
+        for process in self.processes:
+            if process.node_name not in keys:
+                keys.append(process.node_name)
+        if self.tasks:
+            keys.append('task_status')
+        return keys
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        if key == 'task_status' and self.tasks:
+            return self.tasks
+        result = dict([(process.process_name, dict(process.fields)) \
+                for process in self.processes if process.node_name == key])
+        if not result:
+            raise KeyError(key)
+        return result
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return "VolumeStatus(%r)" % self.name
+
+
+class LazyVolumes(object):
+    """
+        Read only dict of volume name to the volume records. The xml output
+        is parsed once and its volume elements are indexed by name, but
+        they are turned into records only when looked up.
+    """
+    def __init__(self, output, record_class):
+        self._records = {}
+        self._elements = {}
+        self._order = []
+        self._record_class = record_class
+        self.op_ret = self.op_errstr = None
+        try:
+            root = etree.XML(output)
+        except (SyntaxError, TypeError):
+            return
+        self.op_ret = root.findtext('opRet')
+        self.op_errstr = root.findtext('opErrstr')
+        for elem in root.findall('*/volumes/volume'):
+            name = elem.findtext(record_class.name_tag)
+            self._elements[name] = elem
+            self._order.append(name)
+
+    def __getitem__(self, name):
+        record = self._records.get(name)
+        if record is None:
+            record = self._record_class(self._elements[name])
+            self._records[name] = record
+        return record
+
+    def __contains__(self, name):
+        return name in self._elements
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __nonzero__(self):
+        return bool(self._order)
+
+    __bool__ = __nonzero__
+
+    def __len__(self):
+        return len(self._order)
+
+    def keys(self):
+        return list(self._order)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def values(self):
+        return [self[name] for name in self._order]
+
+    def items(self):
+        return [(name, self[name]) for name in self._order]
+
+    def __repr__(self):
+        return "LazyVolumes(%r)" % self.keys()
+
+
+def parse_volume_info(output):
+    """
+        Parses the output of gluster volume info --xml
+
+        Returns a LazyVolumes of volume name to Volume. Returns None if
+        the command had failed.
+    """
+    volumes = LazyVolumes(output, Volume)
+    if volumes.op_ret != '0':
+        return None
+    return volumes
+
+
+def parse_volume_status(output):
+    """
+        Parses the output of gluster volume status --xml
+
+        Returns a LazyVolumes of volume name to VolumeStatus. Returns None
+        if the command had failed.
+    """
+    volumes = LazyVolumes(output, VolumeStatus)
+    if volumes.op_ret != '0':
+        return None
+    return volumes
@@ -0,0 +1,113 @@
+#  This file is part of DiSTAF
+#  Copyright (C) 2015-2016  Red Hat, Inc. <http://www.redhat.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Asynchronous logging for distaf.
+
+    The thread logging a message only puts the log record in a queue. A
+    background thread (LogListener) formats the records and writes them to
+    the log files, and writes the full command outputs to artifact files.
+    python 2 does not have logging.handlers.QueueHandler, hence these.
+"""
+
+
+import os
+import logging
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class QueueHandler(logging.Handler):
+    """
+        Handler which just puts the log records in the queue
+    """
+    def __init__(self, log_queue):
+        logging.Handler.__init__(self)
+        self.queue = log_queue
+
+    def emit(self, record):
+        self.queue.put(record)
+
+
+class ArtifactHandler(logging.Handler):
+    """
+        Writes the data attached to log records as 'artifact_data' to the
+        file 'artifact_path'. Other records are ignored.
+    """
+    def emit(self, record):
+        path = getattr(record, 'artifact_path', None)
+        if path is None:
+            return
+        try:
+            dirname = os.path.dirname(path)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            with open(path, 'w') as fhandle:
+                fhandle.write(record.artifact_data)
+        except (IOError, OSError):
+            self.handleError(record)
+
+
+class LogListener():
+    """
+        Background thread which hands the log records from the queue over
+        to the handlers. Handlers added or removed with add_handler and
+        remove_handler get only the records logged after/before that call.
+    """
+    def __init__(self, log_queue, *handlers):
+        self.queue = log_queue
+        self.handlers = list(handlers)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+            Writes out the pending records and stops the thread
+        """
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def add_handler(self, handler):
+        self.queue.put(lambda: self.handlers.append(handler))
+
+    def remove_handler(self, handler):
+        def remove():
+            self.handlers.remove(handler)
+            handler.close()
+        self.queue.put(remove)
+
+    def _serve(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if callable(item):
+                item()
+                continue
+            for handler in self.handlers:
+                if item.levelno >= handler.level:
+                    handler.handle(item)
@@ -29,7 +29,10 @@ if os.getcwd() not in sys.path:
     sys.path.append(os.getcwd())
 
 from distaf.util import testcases, test_list, distaf_init, distaf_finii, \
-                        test_seq, test_mounts
+                        test_seq, test_mounts, test_configs
+from distaf.config_parser import get_global_config
+from distaf.scheduler import schedule, estimate, shard
+from distaf.results_store import open_cost_model
 
 
 def collect_tests(_dir="tests_d"):
@@ -59,31 +62,60 @@ class gluster_tests(unittest.TestCase):
     pass
 
 
-def set_tests(tests=''):
+def reuses_setup(test):
+    """
+        Returns True if the test reuses the setup of the previous test
+    """
+    return test_configs.get(test, {}).get('reuse_setup', True)
+
+
+def set_tests(tests='', voltypes='', costs=None, reorder=False, \
+        pipeline=False, shards=None):
     """
         Sets the gluster_tests Test class with the test cases.
         Name of the tests will be prepended with test_ to enable
         unittest to recognise them as test case
+
+        If voltypes is given, only the tests of those voltypes are set.
+        If shards is given as (count, index), only the tests of that shard
+        out of count shards of the same estimated duration are set.
+        If reorder is True, the tests are ordered to spend the least time
+        in the volume setup and cleanup. The estimates are from costs (a
+        CostModel).
     """
     if tests == '':
         tests = testcases.keys()
     if test_list == {}:
         test_list[''] = testcases.keys()
-    i = 0
+    entries = []
     for voltype, vol_tests in test_list.iteritems():
         for test in vol_tests:
             if test in tests:
+                if test not in testcases:
+                    sys.stderr.write("Unable to find test %s." \
+                                     "Skipping...\n" % test)
+                    continue
                 if test not in test_mounts:
                     test_mounts[test] = ['']
                 for mount in test_mounts[test]:
-                    try:
-                        setattr(gluster_tests, "test_%d_%s_%s_%s" % \
-                                (i, voltype, mount, test), testcases[test])
-                        i = i + 1
-                        test_seq.append((voltype, mount))
-                    except KeyError:
-                        sys.stderr.write("Unable to find test %s." \
-                                         "Skipping...\n" % test)
+                    entries.append((voltype, mount, test))
+    # Sharded before filtering the voltypes, so that the partitions of a
+    # shard get the same split as their parent
+    if shards is not None:
+        entries = shard(entries, shards[0], reuses_setup, costs)[shards[1]]
+    if voltypes != '':
+        entries = [entry for entry in entries if entry[0] in voltypes]
+    if reorder:
+        scheduled = schedule(entries, reuses_setup, costs, pipeline)
+        sys.stderr.write("Estimated time to run the tests: %d seconds " \
+                "(%d seconds unscheduled)\n" % (estimate(scheduled, \
+                reuses_setup, costs, pipeline), estimate(entries, \
+                reuses_setup, costs, pipeline)))
+        entries = scheduled
+    for i, (voltype, mount, test) in enumerate(entries):
+        setattr(gluster_tests, "test_%d_%s_%s_%s" % \
+                (i, voltype, mount, test), testcases[test])
+        test_seq.append((voltype, mount, test))
 
 
 def main():
@@ -96,25 +128,77 @@ def main():
     parser.add_argument("-j", help="Directory to store JUnit XML file",
                               action="store",
                               dest="xmldir")
+    parser.add_argument("-p", "--partitions", type=int, default=1,
+                        help="Run the tests in parallel on these many "
+                             "disjoint partitions of the nodes and clients")
+    parser.add_argument("--voltypes", help="Run only the tests of these "
+                        "volume types")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Split the tests into these many shards of "
+                             "about the same duration, as per the durations "
+                             "recorded in results_db")
+    parser.add_argument("--shard", type=int, default=0,
+                        help="The shard to run, from 0 to SHARDS - 1")
+    parser.add_argument("--results-until", type=float,
+                        help="Use only the durations recorded in results_db "
+                             "before this time (seconds since the epoch). "
+                             "All the shards should be given the same time")
     args = parser.parse_args()
-
-    _ = distaf_init(args.c)
-
+    if not 0 <= args.shard < args.shards:
+        parser.error("--shard should be from 0 to %d" % (args.shards - 1))
+    if args.shards > 1 and args.results_until is None:
+        parser.error("--shards needs --results-until, so that all the "
+                     "shards are computed from the same durations")
+
+    # Validated before distaf_init connects to all the nodes
+    configs = get_global_config(args.c.split())
+    if args.partitions > 1 and configs['global_mode']:
+        sys.stderr.write("Partitions can not be used in global_mode\n")
+        sys.exit(1)
+    if args.shards > 1 and not configs.get('results_db'):
+        sys.stderr.write("--shards needs results_db in the config\n")
+        sys.exit(1)
+    if args.partitions <= 1:
+        configs = distaf_init(args.c)
+
+    if args.results_until is not None:
+        configs['results_until'] = args.results_until
+    costs = open_cost_model(configs)
+    shards = None
+    if args.shards > 1:
+        shards = (args.shards, args.shard)
+    voltypes = ''
+    if args.voltypes != None:
+        voltypes = args.voltypes.split(' ')
+    tests = ''
+    if args.t != None:
+        tests = args.t.split(' ')
     if args.f != None:
         collect_tests(args.f)
-        set_tests()
-    elif args.d != None and args.t != None:
-        collect_tests("tests_d/%s" % args.d)
-        set_tests(args.t.split(' '))
-    elif args.t != None:
-        collect_tests()
-        set_tests(args.t.split(' '))
+        tests = ''
     elif args.d != None:
         collect_tests("tests_d/%s" % args.d)
-        set_tests()
     else:
         collect_tests()
-        set_tests()
+    set_tests(tests, voltypes, costs, configs.get('schedule_tests'), \
+            configs.get('pipeline_setup'), shards)
+
+    if args.partitions > 1:
+        from distaf.partition import run_partitions
+        test_args = []
+        for option in ('t', 'd', 'f'):
+            if getattr(args, option) != None:
+                test_args += ['-%s' % option, getattr(args, option)]
+        if shards is not None:
+            test_args += ['--shards', str(args.shards), \
+                    '--shard', str(args.shard), \
+                    '--results-until', repr(args.results_until)]
+        ret = run_partitions(args.c.split(), configs, test_seq, \
+                args.partitions, test_args, args.xmldir, \
+                lambda group: estimate(group, reuses_setup, costs, \
+                configs.get('pipeline_setup')), \
+                getattr(costs, 'until', None))
+        sys.exit(0 if ret else 1)
 
     get_num = lambda x: int(re.search(r'test_([0-9]+)_', x).group(1))
     sortcmp = lambda _, x, y: cmp(get_num(x), get_num(y))
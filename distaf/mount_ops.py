@@ -39,17 +39,23 @@ def mount_volume(volname, mtype='glusterfs', mpoint='/mnt/glusterfs', \
         options = "%s,vers=3" % options
     elif mtype == 'nfs' and options == '':
         options = '-o vers=3'
-    ret, _, _ = tc.run(mclient, "mount | grep %s | grep %s | grep \"%s\"" \
-            % (volname, mpoint, mserver), verbose=False)
-    if ret == 0:
+    mcmd = "mount -t %s %s %s:%s %s" % \
+            (mtype, options, mserver, volname, mpoint)
+    # The mount check fails (and hence stops the batch) if already mounted
+    cmds = ["! (mount | grep %s | grep %s | grep \"%s\")" \
+            % (volname, mpoint, mserver), "test -d %s || mkdir -p %s" \
+            % (mpoint, mpoint), mcmd]
+    ret = tc.run_batch(mclient, cmds, verbose=False)
+    if ret is None:
+        return (-1, -1, -1)
+    if ret[0][0] != 0:
         tc.logger.debug("Volume %s is already mounted at %s" \
         % (volname, mpoint))
         return (0, '', '')
-    mcmd = "mount -t %s %s %s:%s %s" % \
-            (mtype, options, mserver, volname, mpoint)
-    tc.run(mclient, "test -d %s || mkdir -p %s" % (mpoint, mpoint), \
-            verbose=False)
-    return tc.run(mclient, mcmd)
+    if ret[-1][0] != 0:
+        # Log the output of the failed step, for the diagnostics
+        tc.log_output(cmds[len(ret) - 1], mclient, *ret[-1])
+    return ret[-1]
 
 
 def umount_volume(client, mountpoint):
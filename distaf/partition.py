@@ -0,0 +1,285 @@
+#  This file is part of DiSTAF
+#  Copyright (C) 2015-2016  Red Hat, Inc. <http://www.redhat.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Runs the tests in parallel on disjoint partitions of the test machines.
+
+    The nodes, peers and clients of the config are split into partitions,
+    each big enough for the voltypes to be run. The voltypes are assigned
+    to the partitions (all the tests of a voltype run on the same partition,
+    so that they can reuse the volume) and a distaf process is run for each
+    partition, with a config which has only the machines of the partition.
+    The results of the processes are merged into one report.
+"""
+
+
+import os
+import re
+import sys
+import json
+import yaml
+import shutil
+import tempfile
+import subprocess
+try:
+    import xml.etree.cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+from distaf.config_parser import get_global_config
+from distaf.volume_ops import get_voltype_params
+
+
+# The config keys of output paths, which get a suffix per partition
+PARTITION_PATHS = ('log_file', 'stats_file', 'artifact_dir', 'test_log_dir', \
+        'schedule_costs_file')
+
+
+def nodes_needed(voltype, config_data):
+    """
+        Returns the number of servers needed for a volume of voltype, i.e.
+        the number of bricks in each replica/disperse set
+    """
+    params = get_voltype_params(voltype, config_data)
+    if params is None:
+        return 1
+    _, rep, dispd, red, stripe, _ = params
+    if rep == 1 and dispd != 1:
+        # create_volume makes each disperse set of dispd + red bricks
+        return dispd + red
+    return max(rep * stripe, 1)
+
+
+def partition_count(count, voltypes, config_data):
+    """
+        Returns the number of partitions (at most count) which can be made
+        such that each partition has a client and enough nodes for each of
+        the voltypes
+    """
+    needed = max([nodes_needed(voltype, config_data) \
+            for voltype in voltypes] + [1])
+    clients = len(config_data['clients'] or {})
+    return max(min(count, len(config_data['nodes']) // needed, clients), 1)
+
+
+def split(machines, count):
+    """
+        Splits the machines into count lists of (nearly) the same size
+    """
+    machines = sorted(machines)
+    return [machines[i::count] for i in range(count)]
+
+
+def assign_voltypes(weights, count):
+    """
+        Assigns the voltypes to count partitions, the heaviest voltype
+        first to the least loaded partition. weights is a dict of voltype
+        to its weight (like the number of tests)
+
+        Returns a list of list of voltypes of each partition
+    """
+    loads = [0] * count
+    partitions = [[] for _ in range(count)]
+    for voltype in sorted(weights, key=lambda v: (-weights[v], v)):
+        index = loads.index(min(loads))
+        partitions[index].append(voltype)
+        loads[index] += weights[voltype]
+    return partitions
+
+
+def partition_config(config_data, index, nodes, peers, clients, \
+        until=None):
+    """
+        Returns the config overrides for the partition index. until is the
+        time up to which the recorded durations are to be used for the
+        estimates, so that all the partitions compute the same shards.
+
+        The volumes are dropped, as their nodes would be added to the nodes
+        of the partition (they are only used in global_mode anyway).
+    """
+    config = {'volumes': {}}
+    if until is not None:
+        config['results_until'] = until
+    for key, machines in (('nodes', nodes), ('peers', peers), \
+            ('clients', clients)):
+        config[key] = dict([(machine, (config_data[key] or {})[machine]) \
+                for machine in machines])
+    for key in PARTITION_PATHS:
+        if config_data.get(key):
+            root, ext = os.path.splitext(config_data[key])
+            config[key] = "%s.part%d%s" % (root, index, ext)
+    return config
+
+
+def merge_junit(xmldirs, output):
+    """
+        Merges the JUnit XML files in xmldirs (one per partition) into
+        the file output
+    """
+    merged = etree.Element('testsuites')
+    totals = {'tests': 0, 'failures': 0, 'errors': 0, 'skipped': 0}
+    for index, xmldir in enumerate(xmldirs):
+        if not os.path.isdir(xmldir):
+            continue
+        for fname in sorted(os.listdir(xmldir)):
+            if not fname.endswith('.xml'):
+                continue
+            root = etree.parse(os.path.join(xmldir, fname)).getroot()
+            suites = [root] if root.tag == 'testsuite' \
+                    else root.findall('testsuite')
+            for suite in suites:
+                suite.set('name', "%s.part%d" % (suite.get('name'), index))
+                for key in totals:
+                    totals[key] += int(suite.get(key, 0))
+                merged.append(suite)
+    for key, value in totals.items():
+        merged.set(key, str(value))
+    etree.ElementTree(merged).write(output, encoding='UTF-8')
+    return output
+
+
+def merge_costs(path, paths):
+    """
+        Merges the costs files in paths (one per partition, each a copy of
+        path when the partitions started) back into path. The costs changed
+        by more than one partition (like those of any voltype) are averaged.
+    """
+    costs = {}
+    if os.path.isfile(path):
+        with open(path) as fhandle:
+            costs = json.load(fhandle)
+    changed = {}
+    for part_path in paths:
+        if not os.path.isfile(part_path):
+            continue
+        with open(part_path) as fhandle:
+            for key, value in json.load(fhandle).items():
+                if costs.get(key) != value:
+                    changed.setdefault(key, []).append(value)
+    for key, values in changed.items():
+        costs[key] = sum(values) / len(values)
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'w') as fhandle:
+        json.dump(costs, fhandle, indent=1, sort_keys=True)
+    return path
+
+
+def summarize(output):
+    """
+        Returns the tuple of (tests, failures, errors) from the output of
+        the unittest TextTestRunner
+    """
+    tests = failures = errors = 0
+    match = re.search(r'^Ran (\d+) tests?', output, re.M)
+    if match is not None:
+        tests = int(match.group(1))
+    match = re.search(r'^FAILED \((.*)\)', output, re.M)
+    if match is not None:
+        counts = dict(re.findall(r'(\w+)=(\d+)', match.group(1)))
+        failures = int(counts.get('failures', 0))
+        errors = int(counts.get('errors', 0))
+    return (tests, failures, errors)
+
+
+def run_partitions(config_files, config_data, entries, count, \
+        test_args=(), xmldir=None, weigh=len, until=None):
+    """
+        Runs the tests in entries (list of (voltype, mount, test) like
+        test_seq) on count partitions of the machines, in parallel.
+        test_args are the test selection arguments (-t/-d/-f/--shards) of
+        distaf to be passed to each partition. weigh(entries) returns the
+        weight of the entries of a voltype, to balance the partitions by.
+
+        Returns True if all the tests passed, False otherwise
+    """
+    groups = {}
+    for entry in entries:
+        groups.setdefault(entry[0], []).append(entry)
+    weights = dict([(voltype, weigh(group)) \
+            for voltype, group in groups.items()])
+    count = min(partition_count(count, weights.keys(), config_data), \
+            max(len(weights), 1))
+    nodes = split(config_data['nodes'], count)
+    peers = split(config_data['peers'] or {}, count)
+    clients = split(config_data['clients'] or {}, count)
+    voltypes = assign_voltypes(weights, count)
+    workdir = tempfile.mkdtemp(prefix='distaf-partitions-')
+    configs = []
+    for index in range(count):
+        config = partition_config(config_data, index, nodes[index], \
+                peers[index], clients[index], until)
+        config_file = os.path.join(workdir, "config.part%d.yml" % index)
+        with open(config_file, 'w') as fhandle:
+            yaml.safe_dump(config, fhandle, default_flow_style=False)
+        loaded = get_global_config(list(config_files) + [config_file])
+        if sorted(loaded['nodes']) != sorted(nodes[index]):
+            sys.stderr.write("The config of partition %d has the nodes %s " \
+                    "instead of %s\n" % (index, ' '.join(sorted( \
+                    loaded['nodes'])), ' '.join(nodes[index])))
+            shutil.rmtree(workdir)
+            return False
+        configs.append((config, config_file))
+    # Each partition records the durations to a copy of the costs file
+    costs_file = config_data.get('schedule_costs_file')
+    for config, _ in configs:
+        if costs_file and os.path.isfile(costs_file):
+            shutil.copy(costs_file, config['schedule_costs_file'])
+        elif costs_file and os.path.isfile(config['schedule_costs_file']):
+            os.remove(config['schedule_costs_file'])
+    procs = []
+    for index, (config, config_file) in enumerate(configs):
+        cmd = [sys.executable, '-m', 'distaf.main', \
+                '-c', ' '.join(list(config_files) + [config_file]), \
+                '--voltypes', ' '.join(voltypes[index])] + list(test_args)
+        if xmldir is not None:
+            cmd += ['-j', os.path.join(workdir, "xml.part%d" % index)]
+        log = open(os.path.join(workdir, "output.part%d" % index), 'w+')
+        sys.stdout.write("Partition %d: %s on nodes %s, clients %s\n" \
+                % (index, ' '.join(voltypes[index]), ' '.join(nodes[index]), \
+                ' '.join(clients[index])))
+        procs.append((subprocess.Popen(cmd, stdout=log, \
+                stderr=subprocess.STDOUT), log))
+    totals = [0, 0, 0]
+    for index, (proc, log) in enumerate(procs):
+        proc.wait()
+        log.seek(0)
+        output = log.read()
+        log.close()
+        sys.stdout.write("\n==== Partition %d (exit status %d) ====\n%s" \
+                % (index, proc.returncode, output))
+        for i, value in enumerate(summarize(output)):
+            totals[i] += value
+    if costs_file:
+        merge_costs(costs_file, [config['schedule_costs_file'] \
+                for config, _ in configs])
+        for config, _ in configs:
+            if os.path.isfile(config['schedule_costs_file']):
+                os.remove(config['schedule_costs_file'])
+    if xmldir is not None:
+        if not os.path.isdir(xmldir):
+            os.makedirs(xmldir)
+        merge_junit([os.path.join(workdir, "xml.part%d" % index) \
+                for index in range(count)], \
+                os.path.join(xmldir, "TEST-distaf-partitions.xml"))
+    shutil.rmtree(workdir)
+    passed = totals[1] == 0 and totals[2] == 0 and \
+            all([proc.returncode == 0 for proc, _ in procs])
+    sys.stdout.write("\nRan %d tests in %d partitions: %s (failures=%d, " \
+            "errors=%d)\n" % (totals[0], count, \
+            "OK" if passed else "FAILED", totals[1], totals[2]))
+    return passed
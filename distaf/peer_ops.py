@@ -22,13 +22,14 @@
 
 
 from distaf.util import tc
+from distaf.waiters import wait_for_peers_connected, wait_for_peers_detached
 import re
-import time
 
 
 def peer_probe(pnode='', servers='', timeout=10):
     """
-        Does peer probe and validates the same
+        Does peer probe and validates the same, after waiting at most
+        timeout seconds for the peers to get connected
         Returns True on success and False on failure
         Note: Input for parameter 'servers' should be in list format
     """
@@ -47,7 +48,7 @@ def peer_probe(pnode='', servers='', timeout=10):
                     re.search(r'^peer\sprobe\:\ssuccess(.*)', ret[1]) is None:
                 tc.logger.error("Failed to do peer probe for node %s" % server)
                 return False
-    time.sleep(timeout)
+    wait_for_peers_connected(servers, pnode, timeout)
 
     #Validating whether peer probe is successful
     if not validate_peer_status(pnode, servers):
@@ -59,7 +60,8 @@ def peer_probe(pnode='', servers='', timeout=10):
 
 def peer_detach(pnode='', servers='', force=False, timeout=10):
     """
-        Does peer detach and validates the same
+        Does peer detach and validates the same, after waiting at most
+        timeout seconds for the peers to be gone
         Returns True on success and False on failure
         Note: Input for parameter 'servers' should be in list format
     """
@@ -79,7 +81,7 @@ def peer_detach(pnode='', servers='', force=False, timeout=10):
             tc.logger.error("Failed to do peer detach for node %s" % server)
             return False
 
-    time.sleep(timeout)
+    wait_for_peers_detached(servers, pnode, timeout)
     #Validating whether peer detach is successful
     if validate_peer_status(pnode, servers):
         tc.logger.error("peer detach validatiom failed")
@@ -163,6 +165,7 @@ def pool_list(pnode=''):
     if pnode == '':
         pnode = tc.nodes[0]
 
+    # Not cached, the Connected state of the peers changes by itself
     ret = tc.run(pnode, "gluster pool list")
     if ret[0] != 0:
         tc.logger.error("Failed to execute pool list in node %s" % pnode)
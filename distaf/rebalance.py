@@ -18,12 +18,22 @@
 
 import re
 import time
+from collections import namedtuple
 from distaf.util import tc
+try:
+    import xml.etree.cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
 
 """
     Libraries containing gluster rebalance operations
 """
 
+# Rebalance status of a node as in gluster volume rebalance status --xml.
+# size is in bytes and runtime in seconds
+RebalNodeStatus = namedtuple('RebalNodeStatus', ['node', 'files', 'size', \
+        'lookups', 'failures', 'skipped', 'status', 'runtime'])
+
 def get_rebal_nodes(server):
     '''
     This function finds out the number of rebalance nodes from
@@ -52,6 +62,55 @@ def get_rebal_dict(status):
     return rebal_dict
 
 
+def parse_rebal_status_xml(output):
+    '''
+    Parses the output of gluster volume rebalance <volname> status --xml
+
+    Returns a dict of node name to its RebalNodeStatus. The totals are
+    under the key 'aggregate'. Returns None if the command had failed.
+    '''
+    try:
+        root = etree.XML(output)
+    except (SyntaxError, TypeError):
+        return None
+    if root.findtext('opRet') != '0':
+        return None
+    records = {}
+    for elem in root.findall('volRebalance/node') + \
+            root.findall('volRebalance/aggregate'):
+        name = elem.findtext('nodeName', 'aggregate')
+        records[name] = RebalNodeStatus(name, \
+                int(elem.findtext('files', 0)), \
+                int(elem.findtext('size', 0)), \
+                int(elem.findtext('lookups', 0)), \
+                int(elem.findtext('failures', 0)), \
+                int(elem.findtext('skipped', 0)), \
+                elem.findtext('statusStr', ''), \
+                float(elem.findtext('runtime', 0)))
+    return records
+
+
+def _rebal_state(records):
+    '''
+    Returns the overall state of the rebalance and the rebalance dict (as
+    returned by get_rebal_status) from the per node records
+    '''
+    nodes = [record for name, record in records.items() \
+            if name != 'aggregate']
+    rebal_dict = dict([(record.node, [str(record.files), str(record.size), \
+            str(record.lookups), str(record.failures), str(record.skipped), \
+            record.status, "%.2f" % record.runtime]) for record in nodes])
+    states = [record.status for record in nodes]
+    if [state for state in states if "failed" in state]:
+        return ("failed", rebal_dict)
+    if [state for state in states if "in progress" in state]:
+        return ("in progress", rebal_dict)
+    # fix-layout reports 'fix-layout completed'
+    if states and all([state.endswith("completed") for state in states]):
+        return ("completed", rebal_dict)
+    return ("invalid status", rebal_dict)
+
+
 def get_rebal_status(volname, server=''):
     '''
     This function gives rebalance status
@@ -60,44 +119,134 @@ def get_rebal_status(volname, server=''):
     '''
     if server == "":
         server = tc.nodes[0]
-    status = tc.run(server, "gluster v rebalance %s status" %volname)
-    if status[0] != 0:
-        if "not started" in status[2]:
+    status = tc.run(server, "gluster v rebalance %s status --xml" % volname)
+    records = parse_rebal_status_xml(status[1])
+    if status[0] != 0 or records is None:
+        if "not started" in "%s %s" % (status[1], status[2]):
             tc.logger.error("Rebalance has not started")
             return ("not started", " ")
         else:
             tc.logger.error("error")
             return ("error", " ")
+    state, rebal_dict = _rebal_state(records)
+    if state == "failed":
+        tc.logger.error("Rebalance failed")
+    elif state == "in progress":
+        tc.logger.info("Rebalance is in progress")
+    elif state == "completed":
+        tc.logger.info("Rebalance is completed")
     else:
-        rebal_dict = get_rebal_dict(status[1])
-        if "failed" in status[1]:
-            tc.logger.error("Rebalance status command failed")
-            return ("failed", rebal_dict)
-        elif "in progress" in status[1]:
-            tc.logger.info("Rebalance is in progress")
-            return ("in progress", rebal_dict)
-        elif "completed" in status[1]:
-            counter = status[1].count("completed")
-            nnodes = get_rebal_nodes(server)
-            if counter == nnodes:
-                tc.logger.info("Rebalance is completed")
-                return ("completed", rebal_dict)
+        tc.logger.error("Rebalance has not completed on all nodes")
+    return (state, rebal_dict)
+
+
+class RebalanceMonitor():
+    """
+        Watches the rebalance of a volume till it is done, recording the
+        progress of each node.
+
+        The interval between the polls is a tenth of the time the monitor
+        has been waiting, bounded by min_interval and max_interval. So a
+        short rebalance is noticed to be done within a fraction of a second,
+        while a long one is not polled needlessly often.
+    """
+    def __init__(self, volname, server='', min_interval=0.05, \
+            max_interval=20):
+        if server == '':
+            server = tc.nodes[0]
+        self.volname = volname
+        self.server = server
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # List of (timestamp, dict of node to RebalNodeStatus)
+        self.samples = []
+
+    def poll(self):
+        """
+            Fetches the rebalance status once and records it
+
+            Returns the dict of node to RebalNodeStatus, None on failure
+        """
+        ret = tc.run(self.server, "gluster volume rebalance %s status --xml" \
+                % self.volname, verbose=False)
+        records = parse_rebal_status_xml(ret[1])
+        if ret[0] != 0 or records is None:
+            tc.logger.error("Unable to get the rebalance status of %s" \
+                    % self.volname)
+            return None
+        self.samples.append((time.time(), records))
+        return records
+
+    def wait(self, timeout=300):
+        """
+            Polls till the rebalance is no longer in progress or till
+            timeout seconds
+
+            Returns the state and rebalance dict, as get_rebal_status does
+        """
+        started = time.time()
+        while True:
+            records = self.poll()
+            if records is None:
+                return ("error", " ")
+            state, rebal_dict = _rebal_state(records)
+            elapsed = time.time() - started
+            if state != "in progress" or elapsed >= timeout:
+                self.report()
+                return (state, rebal_dict)
+            interval = min(max(elapsed / 10, self.min_interval), \
+                    self.max_interval)
+            time.sleep(min(interval, timeout - elapsed))
+
+    def series(self, node='aggregate'):
+        """
+            Returns the list of (timestamp, files, size) of the node, i.e.
+            the files and bytes it had moved at each poll
+        """
+        return [(timestamp, records[node].files, records[node].size) \
+                for timestamp, records in self.samples if node in records]
+
+    def throughput(self):
+        """
+            Returns a dict of node (and 'aggregate') to the tuple of
+            (files per second, bytes per second) moved by its rebalance so
+            far, as per the latest poll
+        """
+        if not self.samples:
+            return {}
+        result = {}
+        for name, record in self.samples[-1][1].items():
+            if record.runtime > 0:
+                result[name] = (record.files / record.runtime, \
+                        record.size / record.runtime)
             else:
-                tc.logger.error("Rebalacne has not completed on all nodes")
-                return ("invalid status", rebal_dict)
+                result[name] = (0.0, 0.0)
+        return result
+
+    def report(self):
+        """
+            Logs the files and bytes moved and the throughput of each node
+        """
+        if not self.samples:
+            return
+        records = self.samples[-1][1]
+        for name, (files_rate, bytes_rate) in \
+                sorted(self.throughput().items()):
+            record = records[name]
+            tc.logger.info("Rebalance of %s on %s: %s, %d files (%d bytes) "
+                           "moved in %.2f seconds, %.2f files/s, %.2f "
+                           "bytes/s" % (self.volname, name, record.status, \
+                           record.files, record.size, record.runtime, \
+                           files_rate, bytes_rate))
+
 
 def wait_rebal_complete(volname, time_out = 300, server=''):
     '''
-    This function calls rebalance_status_once function and
-    waits if the rebalance status is in progress, exists on timeout,
+    This function waits (with a RebalanceMonitor) till the rebalance is no
+    longer in progress, exits on timeout,
     default timeout is 300sec(5 min)
     '''
-    ret = get_rebal_status(volname, server)
-    while time_out != 0 and ret[0] == "in progress":
-        time_out = time_out - 20
-        time.sleep(20)
-        ret = get_rebal_status(volname, server)
-    return ret
+    return RebalanceMonitor(volname, server).wait(time_out)
 
 
 def rebal_start(volname, server=''):
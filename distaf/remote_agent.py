@@ -0,0 +1,226 @@
+#  This file is part of DiSTAF
+#  Copyright (C) 2015-2016  Red Hat, Inc. <http://www.redhat.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    The helper agent which is deployed to every remote node by BigBang.
+
+    Each function here works on many files at once, so that library code
+    can do thousands of file operations in a single rpyc call instead of a
+    network round trip per attribute access of the netrefs.
+
+    This module runs in the remote node and hence should depend only on the
+    python standard library. Functions return a dict with an entry per path,
+    whose value is an error string if the operation on that path failed.
+"""
+
+
+import os
+import time
+import pickle
+import hashlib
+import subprocess
+
+
+def call(func, payload):
+    """
+        Entry point used by BigBang.call_agent. The arguments and the return
+        value are pickled, so that they are passed by value instead of as
+        netrefs.
+    """
+    args = pickle.loads(payload)
+    return pickle.dumps(globals()[func](*args), 2)
+
+
+def run_batch(cmds, stop_on_failure=True):
+    """
+        Runs the commands one after the other
+
+        Returns a list of (retcode, stdout, stderr) of each command run
+    """
+    results = []
+    for cmd in cmds:
+        p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, \
+                stderr=subprocess.PIPE)
+        pout, perr = p.communicate()
+        results.append((p.returncode, pout, perr))
+        if stop_on_failure and p.returncode != 0:
+            break
+    return results
+
+
+def relay_run(cmd, targets, user, ssh_options=()):
+    """
+        Runs the cmd in this node and, over ssh, in each of the targets in
+        parallel. Used by BigBang.run_tree with this node as the relay.
+
+        Returns a dict of target to (retcode, stdout, stderr, duration).
+        The result of running cmd in this node is under the key None.
+        retcode is 255 if ssh could not connect to the target.
+    """
+    procs = {}
+    for target in [None] + list(targets):
+        if target is None:
+            args = cmd
+        else:
+            args = ["ssh", "-o", "BatchMode=yes"] + list(ssh_options) + \
+                    ["%s@%s" % (user, target), cmd]
+        procs[target] = (time.time(), subprocess.Popen(args, \
+                shell=target is None, stdout=subprocess.PIPE, \
+                stderr=subprocess.PIPE))
+    results = {}
+    for target, (started, proc) in procs.items():
+        pout, perr = proc.communicate()
+        results[target] = (proc.returncode, pout, perr, \
+                time.time() - started)
+    return results
+
+
+def stat_many(paths):
+    """
+        Returns a dict of path to its os.lstat as a tuple.
+        The value is None for paths which do not exist
+    """
+    result = {}
+    for path in paths:
+        try:
+            result[path] = tuple(os.lstat(path))
+        except OSError:
+            result[path] = None
+    return result
+
+
+def makedirs_many(paths, mode=0o755):
+    """
+        Creates the directories (and their parents) which do not exist
+    """
+    result = {}
+    for path in paths:
+        try:
+            if not os.path.isdir(path):
+                os.makedirs(path, mode)
+            result[path] = True
+        except OSError as err:
+            result[path] = str(err)
+    return result
+
+
+def write_many(files, mode='w'):
+    """
+        Writes the files, where files is a dict of path to its contents.
+        The parent directories are created if not present.
+    """
+    result = {}
+    for path, contents in files.items():
+        try:
+            dirname = os.path.dirname(path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            fhandle = open(path, mode)
+            try:
+                fhandle.write(contents)
+            finally:
+                fhandle.close()
+            result[path] = True
+        except (IOError, OSError) as err:
+            result[path] = str(err)
+    return result
+
+
+def remove_many(paths):
+    """
+        Removes the files. Files which do not exist are ignored
+    """
+    result = {}
+    for path in paths:
+        try:
+            if os.path.lexists(path):
+                os.remove(path)
+            result[path] = True
+        except OSError as err:
+            result[path] = str(err)
+    return result
+
+
+def hash_many(paths, algorithm='sha256', blocksize=1048576):
+    """
+        Returns a dict of path to the hex digest of its contents
+    """
+    result = {}
+    for path in paths:
+        try:
+            digest = hashlib.new(algorithm)
+            fhandle = open(path, 'rb')
+            try:
+                block = fhandle.read(blocksize)
+                while block:
+                    digest.update(block)
+                    block = fhandle.read(blocksize)
+            finally:
+                fhandle.close()
+            result[path] = digest.hexdigest()
+        except (IOError, OSError) as err:
+            result[path] = str(err)
+    return result
+
+
+def getxattr_many(paths, names=None):
+    """
+        Returns a dict of path to a dict of its extended attributes, with
+        values hex encoded (as in getfattr -e hex). If names is given, only
+        those attributes are fetched.
+    """
+    if not hasattr(os, 'getxattr'):
+        return _getfattr_many(paths, names)
+    result = {}
+    for path in paths:
+        try:
+            attrs = {}
+            for name in names or os.listxattr(path, follow_symlinks=False):
+                value = os.getxattr(path, name, follow_symlinks=False)
+                attrs[name] = "0x" + "".join(["%02x" % byte for byte in value])
+            result[path] = attrs
+        except OSError as err:
+            result[path] = str(err)
+    return result
+
+
+def _getfattr_many(paths, names=None):
+    """
+        getxattr_many for python versions without os.getxattr
+    """
+    result = {}
+    for path in paths:
+        cmd = ["getfattr", "-h", "-d", "-m", ".", "-e", "hex", \
+               "--absolute-names", path]
+        try:
+            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, \
+                    stderr=subprocess.PIPE)
+        except OSError as err:
+            result[path] = str(err)
+            continue
+        pout, perr = p.communicate()
+        if p.returncode != 0:
+            result[path] = perr.strip()
+            continue
+        attrs = {}
+        for line in pout.splitlines():
+            if line and not line.startswith('#') and '=' in line:
+                name, value = line.split('=', 1)
+                if not names or name in names:
+                    attrs[name] = value
+        result[path] = attrs
+    return result
@@ -0,0 +1,132 @@
+#  This file is part of DiSTAF
+#  Copyright (C) 2015-2016  Red Hat, Inc. <http://www.redhat.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    History of the durations of the test phases, in a local sqlite database.
+
+    Every setup, run, teardown and cleanup of every test run is recorded
+    with its duration, voltype, mount protocol and result. The estimated
+    duration of a phase is the average of its latest records, so that the
+    scheduler and the sharding adapt to the tests getting slower or faster.
+"""
+
+
+import os
+import time
+import sqlite3
+from distaf.scheduler import CostModel
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS durations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    recorded REAL NOT NULL,
+    phase TEXT NOT NULL,
+    test TEXT NOT NULL,
+    voltype TEXT NOT NULL,
+    mount TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    passed INTEGER
+);
+CREATE INDEX IF NOT EXISTS durations_lookup
+    ON durations (phase, test, voltype, mount);
+"""
+
+
+class ResultsStore(CostModel):
+    """
+        CostModel which keeps every recorded duration in the sqlite database
+        path, and estimates a phase by the average of its latest (history)
+        records. Like CostModel, the phases never recorded are estimated
+        from the records of the test with any voltype and mount protocol,
+        or from defaults.
+
+        The records of the phases which failed are not used. Only the
+        records from before until (by default, the time the store
+        is opened) are used for the estimates. So the estimates do not
+        change during a run, and the processes of a run which are given
+        the same until compute the same schedule and shards.
+    """
+    def __init__(self, path, defaults=None, history=10, until=None):
+        CostModel.__init__(self, None, defaults)
+        self.path = path
+        self.history = history
+        if until is None:
+            until = time.time()
+        self.until = until
+        self.run_id = time.strftime('%Y%m%d-%H%M%S')
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        # Background setup/cleanup threads record too
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.executescript(SCHEMA)
+
+    def get(self, phase, voltype, mount, test=''):
+        """
+            Returns the estimated seconds taken by phase
+        """
+        for fields in self._fallbacks(voltype, mount, test):
+            # Failed phases (like setups failing fast or timing out) are
+            # not representative of their duration
+            where = ['phase = ?', 'recorded < ?', 'passed IS NOT 0']
+            params = [phase, self.until]
+            for column, value in zip(('voltype', 'mount', 'test'), fields):
+                if value:
+                    where.append('%s = ?' % column)
+                    params.append(value)
+            with self.lock:
+                row = self.conn.execute("SELECT AVG(seconds) FROM (SELECT " \
+                        "seconds FROM durations WHERE %s ORDER BY id DESC " \
+                        "LIMIT ?)" % ' AND '.join(where), \
+                        params + [self.history]).fetchone()
+            if row[0] is not None:
+                return row[0]
+        return self.defaults[phase]
+
+    def record(self, phase, voltype, mount, seconds, test='', passed=None):
+        """
+            Records that phase took seconds
+        """
+        if passed is not None:
+            passed = int(bool(passed))
+        with self.lock:
+            self.conn.execute("INSERT INTO durations (run_id, recorded, " \
+                    "phase, test, voltype, mount, seconds, passed) VALUES " \
+                    "(?, ?, ?, ?, ?, ?, ?, ?)", (self.run_id, time.time(), \
+                    phase, test, voltype, mount, seconds, passed))
+            self.conn.commit()
+
+    def save(self):
+        with self.lock:
+            self.conn.commit()
+        return self.path
+
+
+def open_cost_model(config_data):
+    """
+        Returns the ResultsStore of 'results_db' if it is set in config,
+        otherwise the CostModel saved in 'schedule_costs_file'
+    """
+    defaults = config_data.get('schedule_default_costs')
+    if config_data.get('results_db'):
+        return ResultsStore(config_data['results_db'], defaults, \
+                config_data.get('results_history', 10), \
+                config_data.get('results_until'))
+    return CostModel(config_data.get('schedule_costs_file'), defaults)
@@ -0,0 +1,299 @@
+#  This file is part of DiSTAF
+#  Copyright (C) 2015-2016  Red Hat, Inc. <http://www.redhat.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Orders the tests to run so as to spend the least time in setting up
+    and cleaning up volumes and switching the mount protocol.
+
+    The time taken by the setup, run, teardown and cleanup of the tests are
+    recorded per voltype and mount protocol (and per test, for the run) in
+    a CostModel, which is saved across the runs. The scheduler estimates the
+    cost of a test sequence the way the testcase wrapper runs it: a volume
+    is set up when the voltype changes or for a test which does not reuse
+    the setup, and cleaned up before the next volume is set up. When the
+    setup is pipelined, the volume of the next voltype is set up during
+    the last test of the previous one, so only the part of the setup
+    longer than that test adds to the cost.
+"""
+
+
+import os
+import json
+import threading
+
+
+DEFAULT_COSTS = {'setup': 60.0, 'teardown': 1.0, 'cleanup': 30.0, \
+        'mount': 10.0, 'run': 60.0}
+
+
+class CostModel():
+    """
+        Estimated duration (seconds) of each phase (setup, run, teardown,
+        cleanup, mount) of the tests, as the moving average of the recorded
+        durations. Phases never recorded are estimated from the less
+        specific records (e.g. the setup of the voltype with any mount
+        protocol), or from defaults.
+    """
+    def __init__(self, path=None, defaults=None, weight=0.5):
+        self.path = path
+        self.weight = weight
+        self.defaults = dict(DEFAULT_COSTS)
+        if defaults:
+            self.defaults.update(defaults)
+        self.costs = {}
+        self.lock = threading.Lock()
+        if path and os.path.isfile(path):
+            with open(path) as fhandle:
+                self.costs = json.load(fhandle)
+
+    @staticmethod
+    def _fallbacks(voltype, mount, test):
+        """
+            Returns the (voltype, mount, test) of the records from the most
+            to the least specific one. '' stands for any.
+        """
+        fallbacks = []
+        for fields in ((voltype, mount, test), (voltype, '', test), \
+                ('', '', test), (voltype, mount, ''), (voltype, '', ''), \
+                ('', '', '')):
+            if fields not in fallbacks:
+                fallbacks.append(fields)
+        return fallbacks
+
+    def _keys(self, phase, voltype, mount, test):
+        return [':'.join((phase,) + fields) \
+                for fields in self._fallbacks(voltype, mount, test)]
+
+    def get(self, phase, voltype, mount, test=''):
+        """
+            Returns the estimated seconds taken by phase
+        """
+        for key in self._keys(phase, voltype, mount, test):
+            if key in self.costs:
+                return self.costs[key]
+        return self.defaults[phase]
+
+    def record(self, phase, voltype, mount, seconds, test='', passed=None):
+        """
+            Records that phase took seconds. passed is not used by the
+            CostModel, but kept by the ResultsStore.
+        """
+        with self.lock:
+            for key in self._keys(phase, voltype, mount, test):
+                old = self.costs.get(key)
+                if old is None:
+                    self.costs[key] = seconds
+                else:
+                    self.costs[key] = old + self.weight * (seconds - old)
+
+    def save(self):
+        """
+            Saves the records to path, if path was given
+        """
+        if not self.path:
+            return None
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with self.lock:
+            with open(self.path, 'w') as fhandle:
+                json.dump(self.costs, fhandle, indent=1, sort_keys=True)
+        return self.path
+
+
+def run_cost(entry, costs):
+    """
+        Returns the estimated seconds of the run and teardown of the entry
+    """
+    voltype, mount, test = entry
+    return costs.get('run', voltype, mount, test) + \
+            costs.get('teardown', voltype, mount)
+
+
+def estimate(entries, reuses, costs, pipeline=False):
+    """
+        Returns the estimated seconds to run the entries (list of
+        (voltype, mount, test) like test_seq) in that order. reuses(test)
+        tells if the test reuses the setup. If pipeline, the setup of a
+        voltype whose first test reuses the setup runs in the background
+        during the previous test.
+    """
+    total = 0
+    volume = None
+    mount = None
+    last_run = 0
+    for voltype, entry_mount, test in entries:
+        if volume != voltype or not reuses(test):
+            if volume is not None:
+                total += costs.get('cleanup', volume, mount)
+            setup = costs.get('setup', voltype, entry_mount)
+            if pipeline and volume not in (None, voltype) and reuses(test):
+                setup = max(setup - last_run, 0)
+            total += setup
+            volume = voltype
+        elif mount != entry_mount:
+            total += costs.get('mount', voltype, entry_mount)
+        mount = entry_mount
+        last_run = run_cost((voltype, entry_mount, test), costs)
+        total += last_run
+    if volume is not None:
+        total += costs.get('cleanup', volume, mount)
+    return total
+
+
+def _by_mount(entries, first_mount=None):
+    """
+        Returns the entries grouped by mount, in the order of their first
+        entry, except that the group of first_mount comes first
+    """
+    mounts = []
+    for entry in entries:
+        if entry[1] not in mounts:
+            mounts.append(entry[1])
+    if first_mount in mounts:
+        mounts.remove(first_mount)
+        mounts.insert(0, first_mount)
+    return [entry for mount in mounts for entry in entries \
+            if entry[1] == mount]
+
+
+def order_voltype(entries, reuses, costs, pipeline=False):
+    """
+        Orders the entries of one voltype: the tests which do not reuse the
+        setup first (each of them gets a new volume anyway), then the ones
+        which reuse the setup, grouped by the mount protocol. So the mount
+        protocol changes the least number of times. Within each mount
+        protocol, the longest tests run first.
+
+        If pipeline, the group has to start with a test which reuses the
+        setup for its volume to be set up in the background, and the setup
+        of the next voltype overlaps with its last test. So the tests which
+        reuse the setup run first, then the others, and the longest test
+        reusing the setup runs last.
+    """
+    entries = sorted(entries, key=lambda entry: -run_cost(entry, costs))
+    fresh = [entry for entry in entries if not reuses(entry[2])]
+    reusing = [entry for entry in entries if reuses(entry[2])]
+    if pipeline and reusing:
+        longest = reusing.pop(0)
+        # The tests before the longest one end with its mount protocol
+        last_mount = lambda group: list(reversed(_by_mount( \
+                list(reversed(group)), longest[1])))
+        if fresh:
+            return _by_mount(reusing) + last_mount(fresh) + [longest]
+        return last_mount(reusing) + [longest]
+    fresh = _by_mount(fresh)
+    last_mount = None
+    if fresh:
+        last_mount = fresh[-1][1]
+    return fresh + _by_mount(reusing, last_mount)
+
+
+def _best_path(count, saving):
+    """
+        Returns the order of range(count) with the largest sum of
+        saving[i][j] over each i followed by j, by dynamic programming
+        over the subsets (there are only a few voltypes)
+    """
+    best = {}
+    for i in range(count):
+        best[(1 << i, i)] = (0, [i])
+    for mask in range(1, 1 << count):
+        for last in range(count):
+            if (mask, last) not in best:
+                continue
+            value, path = best[(mask, last)]
+            for nxt in range(count):
+                if mask & (1 << nxt):
+                    continue
+                key = (mask | (1 << nxt), nxt)
+                if key not in best or \
+                        value + saving[last][nxt] > best[key][0]:
+                    best[key] = (value + saving[last][nxt], path + [nxt])
+    full = (1 << count) - 1
+    return max([best[(full, last)] for last in range(count)], \
+            key=lambda item: item[0])[1]
+
+
+def schedule(entries, reuses, costs, pipeline=False):
+    """
+        Returns the entries (list of (voltype, mount, test) like test_seq)
+        in the order with the least estimated cost. reuses(test) tells if
+        the test reuses the setup.
+
+        The tests of each voltype are run together, the voltypes taking
+        the longest first. If the setup of the next voltype is done in the
+        background (pipeline), the voltypes are ordered instead so that the
+        setup of each voltype overlaps the most with the last test of the
+        previous one.
+    """
+    groups = []
+    for entry in entries:
+        for group in groups:
+            if group[0][0] == entry[0]:
+                group.append(entry)
+                break
+        else:
+            groups.append([entry])
+    groups = [order_voltype(group, reuses, costs, pipeline) \
+            for group in groups]
+    if not pipeline:
+        groups.sort(key=lambda group: -estimate(group, reuses, costs))
+    else:
+        # The time saved by running a group right after another one
+        alone = [estimate(group, reuses, costs, True) for group in groups]
+        saving = [[alone[i] + alone[j] - estimate(groups[i] + groups[j], \
+                reuses, costs, True) for j in range(len(groups))] \
+                for i in range(len(groups))]
+        groups = [groups[i] for i in _best_path(len(groups), saving)]
+    return [entry for group in groups for entry in group]
+
+
+def shard(entries, count, reuses, costs):
+    """
+        Splits the entries into count shards of about the same estimated
+        duration. The longest tests are assigned first, each to the shard
+        which would then end the earliest, counting the setup and cleanup
+        of a volume when the shard does not have the voltype yet. So the
+        tests of a voltype tend to stay together.
+
+        The split depends only on the entries and the costs, so that every
+        management node sharing the recorded durations computes the same
+        shards. Returns the list of the entries of each shard, in the order
+        of entries.
+    """
+    loads = [0] * count
+    voltypes = [set() for _ in range(count)]
+    assigned = {}
+    for entry in sorted(entries, key=lambda entry: \
+            (-run_cost(entry, costs), entry)):
+        voltype, mount, test = entry
+        volume = costs.get('setup', voltype, mount) + \
+                costs.get('cleanup', voltype, mount)
+
+        def load_after(index):
+            if voltype in voltypes[index] and reuses(test):
+                return loads[index] + run_cost(entry, costs)
+            return loads[index] + run_cost(entry, costs) + volume
+
+        index = min(range(count), key=lambda index: (load_after(index), \
+                index))
+        loads[index] = load_after(index)
+        voltypes[index].add(voltype)
+        assigned[entry] = index
+    return [[entry for entry in entries if assigned[entry] == index] \
+            for index in range(count)]
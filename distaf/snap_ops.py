@@ -18,7 +18,6 @@
 
 
 from distaf.util import tc
-from distaf.volume_ops import start_volume, stop_volume
 
 
 def snap_create(volname, snapname, server='', desc=''):
@@ -72,14 +71,17 @@ def snap_restore(volname, snapname, server=''):
     """
     if server == '':
         server = tc.nodes[0]
-    ret = stop_volume(volname, server)
-    if not ret:
+    ret = tc.run_batch(server, ["gluster volume stop %s --mode=script" \
+            % volname, "gluster snapshot restore %s" % snapname, \
+            "gluster volume start %s" % volname])
+    if ret is None or ret[0][0] != 0:
+        tc.logger.error("Unable to stop the volume %s" % volname)
         return False
-    ret = tc.run(server, "gluster snapshot restore %s" % snapname)
-    if ret[0] != 0:
+    if ret[1][0] != 0:
         tc.logger.error("snapshot restore failed")
         return False
-    ret = start_volume(volname, server)
-    if not ret:
+    if ret[2][0] != 0:
+        tc.logger.error("Unable to start the volume %s after restore" \
+                % volname)
         return False
     return True
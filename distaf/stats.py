@@ -0,0 +1,115 @@
+#  This file is part of DiSTAF
+#  Copyright (C) 2015-2016  Red Hat, Inc. <http://www.redhat.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Per-command instrumentation of BigBang.
+
+    BigBang records the wall time and the bytes transferred of every remote
+    operation along with the library function which asked for it, like
+    volume_ops.get_volume_info. These are aggregated per node, per function
+    and per operation, and dumped as JSON and CSV by distaf_finii.
+"""
+
+
+import csv
+import sys
+import json
+import threading
+
+
+# Modules whose functions are never reported as the caller
+SKIP_MODULES = ('distaf.client_rpyc', 'distaf.stats', 'threading')
+
+FIELDS = ('node', 'caller', 'op', 'count', 'seconds', 'max_seconds', 'bytes')
+
+
+def find_caller(depth=1):
+    """
+        Returns the name of the function (as module.function) outside of
+        BigBang, which made the current call
+    """
+    frame = sys._getframe(depth)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module not in SKIP_MODULES:
+            if module.startswith('distaf.'):
+                module = module[len('distaf.'):]
+            return "%s.%s" % (module, frame.f_code.co_name)
+        frame = frame.f_back
+    return 'unknown'
+
+
+class CommandStats():
+    """
+        Thread safe aggregator of the remote operations done by BigBang
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def record(self, op, node, caller, seconds, nbytes=0):
+        """
+            Records one operation op (like run or upload) done on node on
+            behalf of caller, which took seconds and transferred nbytes
+        """
+        key = (node, caller, op)
+        with self.lock:
+            entry = self.entries.setdefault(key, [0, 0.0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            entry[3] += nbytes
+
+    def rows(self):
+        """
+            Returns the list of aggregated entries as dicts with FIELDS as
+            keys, the most time consuming first
+        """
+        with self.lock:
+            rows = [dict(zip(FIELDS, key + tuple(entry))) \
+                    for key, entry in self.entries.items()]
+        return sorted(rows, key=lambda row: row['seconds'], reverse=True)
+
+    def summary(self, field):
+        """
+            Returns a dict of each value of field (node, caller or op) to
+            the dict of its count, seconds and bytes totals
+        """
+        summary = {}
+        for row in self.rows():
+            total = summary.setdefault(row[field], \
+                    {'count': 0, 'seconds': 0.0, 'bytes': 0})
+            for name in total:
+                total[name] += row[name]
+        return summary
+
+    def dump(self, path):
+        """
+            Writes the stats to path.json and path.csv
+        """
+        rows = self.rows()
+        report = {'by_node': self.summary('node'), \
+                  'by_caller': self.summary('caller'), \
+                  'by_op': self.summary('op'), \
+                  'entries': rows}
+        with open(path + '.json', 'w') as fhandle:
+            json.dump(report, fhandle, indent=2, sort_keys=True)
+        with open(path + '.csv', 'w') as fhandle:
+            writer = csv.DictWriter(fhandle, FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
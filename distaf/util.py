@@ -16,18 +16,29 @@
 #  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 
+import time
+import threading
 from types import FunctionType
 from distaf.client_rpyc import BigBang
 from distaf.config_parser import get_global_config, get_testcase_config
+from distaf.results_store import open_cost_model
 
 
 testcases = {}
 test_list = {}
 test_seq = []
 test_mounts = {}
+test_configs = {}
 globl_configs = {}
 global_mode = None
 tc = None
+costs = None
+# Functions to be called by distaf_finii, before the connections are closed
+finii_hooks = []
+# Threads doing the setup/cleanup of the volumes in the background
+background_tasks = {}
+# The voltype of the last test run
+last_voltype = None
 
 
 def distaf_init(config_file_string="config.yml"):
@@ -35,10 +46,11 @@ def distaf_init(config_file_string="config.yml"):
         The distaf init function which calls the  BigBang
     """
     config_files = config_file_string.split()
-    global globl_configs, global_mode, tc
+    global globl_configs, global_mode, tc, costs
     globl_configs = get_global_config(config_files)
     global_mode = globl_configs['global_mode']
     tc = BigBang(globl_configs)
+    costs = open_cost_model(globl_configs)
     return globl_configs
 
 
@@ -63,42 +75,172 @@ def inject_gluster_logs(label, servers=''):
     return None
 
 
+def run_in_background(key, func, *args):
+    """
+        Runs func(*args) in a background thread. Failures of func (False
+        return or exception) are only logged.
+
+        wait_background(key) waits for it to complete
+    """
+    def target():
+        try:
+            if not func(*args):
+                tc.logger.error("The background %s of %s failed" % key)
+        except Exception:
+            tc.logger.exception("Exception in the background %s of %s" \
+                    % key)
+
+    thread = threading.Thread(target=target, name="%s-%s" % key)
+    thread.daemon = True
+    background_tasks[key] = thread
+    thread.start()
+
+
+def timed(phase, voltype, mount_proto, func, test=''):
+    """
+        Calls func and records the time it took as phase (and if it
+        passed) in the cost model of the scheduler
+
+        Returns the return value of func
+    """
+    started = time.time()
+    ret = func()
+    if costs is not None:
+        costs.record(phase, voltype, mount_proto, time.time() - started, \
+                test, bool(ret))
+    return ret
+
+
+def run_alone(func, *args):
+    """
+        Calls func(*args) with the volume pool paused, for the testcases
+        which restart glusterd or reboot the nodes
+
+        Returns the return value of func
+    """
+    # volume_pool imports this module
+    from distaf.volume_pool import pause_pool, resume_pool
+    pause_pool()
+    try:
+        return func(*args)
+    finally:
+        resume_pool()
+
+
+def wait_background(*keys):
+    """
+        Waits for the background tasks of keys, if they are running
+    """
+    for key in keys:
+        thread = background_tasks.pop(key, None)
+        if thread is not None:
+            thread.join()
+
+
+def prepare_next_volume(voltype):
+    """
+        Sets up the volume of the next test in test_seq in the background,
+        if it is of a voltype other than voltype and the next test reuses
+        the setup. The volume is created with a name of its own, so this
+        can run while the current test is running on its volume.
+
+        The testcases not reusing the setup get their volume from the volume
+        pool, which is already built in the background.
+    """
+    if not test_seq:
+        return
+    next_voltype, next_mount, next_test = test_seq[0]
+    if next_voltype == voltype or \
+            ('prepare', next_voltype) in background_tasks:
+        return
+    next_config = test_configs.get(next_test)
+    if next_config is None or not next_config['reuse_setup']:
+        return
+    # volume_ops imports this module
+    from distaf.volume_ops import setup_vol, get_voltype_params
+    params = get_voltype_params(next_voltype, globl_configs)
+    if params is None:
+        return
+    tc.logger.info("Setting up the %s volume for the next test in the " \
+            "background" % next_voltype)
+    run_in_background(('prepare', next_voltype), timed, 'setup', \
+            next_voltype, next_mount, lambda: setup_vol("%s-testvol" \
+            % next_voltype, *params, servers=tc.nodes), next_test)
+
+
 def testcase(name):
     def decorator(func):
         tc_config = get_testcase_config(func.__doc__)
 
         def wrapper(self):
+            global last_voltype
+            tc.start_test_log(name)
             tc.logger.info("Starting the test: %s" % name)
-            voltype, mount_proto = test_seq.pop(0)
+            voltype, mount_proto = test_seq.pop(0)[:2]
+            pipeline = globl_configs.get('pipeline_setup') and not global_mode
+            # Only the setups which build a volume are timed. The time of the
+            # setup done in the background is recorded by it.
+            builds_volume = voltype != last_voltype or \
+                    not tc_config['reuse_setup']
+            if pipeline and ('prepare', voltype) in background_tasks:
+                builds_volume = False
+            last_voltype = voltype
+            # A disruptive test (restarting glusterd, rebooting the nodes)
+            # can not run along with the background setup/cleanup, nor
+            # with the volume pool building volumes
+            disruptive = tc_config.get('disruptive', False)
+            run = run_alone if disruptive else \
+                    lambda func, *args: func(*args)
+            if pipeline and disruptive:
+                wait_background(*background_tasks.keys())
+            elif pipeline:
+                wait_background(('cleanup', voltype), ('prepare', voltype))
             inject_gluster_logs("%s_%s" % (voltype, name))
             _ret = True
             globl_configs['reuse_setup'] = tc_config['reuse_setup']
             globl_configs.update(tc_config)
             globl_configs['voltype'] = voltype
             globl_configs['mount_proto'] = mount_proto
+            if 'prewarm_nodes' in tc_config:
+                tc.prewarm(tc_config['prewarm_nodes'])
             if isinstance(func, FunctionType):
-                _ret = func()
+                _ret = run(timed, 'run', voltype, mount_proto, func, name)
             else:
                 try:
                     func_obj = func(globl_configs)
-                    ret = func_obj.setup()
+                    if builds_volume:
+                        ret = timed('setup', voltype, mount_proto, \
+                                func_obj.setup, name)
+                    else:
+                        ret = func_obj.setup()
                     if not ret:
                         tc.logger.error("The setup of %s failed" % name)
                         _ret = False
                     if _ret:
-                        ret = func_obj.run()
+                        if pipeline and not disruptive:
+                            prepare_next_volume(voltype)
+                        ret = run(timed, 'run', voltype, mount_proto, \
+                                func_obj.run, name)
                         if not ret:
                             tc.logger.error("The execution of testcase %s " \
                                     "failed" % name)
                             _ret = False
-                    ret = func_obj.teardown()
+                    ret = timed('teardown', voltype, mount_proto, \
+                            func_obj.teardown, name)
                     if not ret:
                         tc.logger.error("The teardown of %s failed" % name)
                         _ret = False
                     if len(test_seq) == 0 or voltype != test_seq[0][0]:
                         tc.logger.info("Last test case to use %s volume type" \
                                 % voltype)
-                        ret = func_obj.cleanup()
+                        if pipeline:
+                            run_in_background(('cleanup', voltype), timed, \
+                                    'cleanup', voltype, mount_proto, \
+                                    func_obj.cleanup, name)
+                            ret = True
+                        else:
+                            ret = timed('cleanup', voltype, mount_proto, \
+                                    func_obj.cleanup, name)
                         if not ret:
                             tc.logger.error("The cleanup of volume %s failed" \
                                     % name)
@@ -112,6 +254,8 @@ def testcase(name):
             return _ret
 
         testcases[name] = wrapper
+        if not isinstance(func, FunctionType):
+            test_configs[name] = tc_config
         if not global_mode and tc_config is not None:
             for voltype in tc_config['runs_on_volumes']:
                 if voltype not in test_list:
@@ -129,5 +273,15 @@ def testcase(name):
 def distaf_finii():
     """
         The fini() function which closes all connection to the servers
+        It also dumps the stats of the remote operations done, if
+        'stats_file' is set in the config, and saves the durations of the
+        test phases to 'results_db' or 'schedule_costs_file'
     """
+    wait_background(*background_tasks.keys())
+    for hook in finii_hooks:
+        hook()
+    if globl_configs.get('stats_file'):
+        tc.stats.dump(globl_configs['stats_file'])
+    if costs is not None:
+        costs.save()
     tc.fini()
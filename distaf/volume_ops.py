@@ -17,16 +17,14 @@
 #  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 
+import os
 import re
-import time
 from distaf.util import tc
-from pprint import pformat
+from distaf.waiters import wait_for_glusterd, wait_for_bricks_online
 from distaf.peer_ops import peer_probe, nodes_from_pool_list
 from distaf.mount_ops import mount_volume
-try:
-    import xml.etree.cElementTree as etree
-except ImportError:
-    import xml.etree.ElementTree as etree
+from distaf.gluster_xml import parse_volume_info, parse_volume_status, \
+        element_to_dict
 from distaf.gluster_init import env_setup_servers, start_glusterd
 
 """
@@ -67,14 +65,17 @@ def create_volume(volname, dist, rep=1, stripe=1, trans='tcp', servers='', \
     n = 0
     tempn = 0
     bricks_list = ''
-    rc = tc.run(servers[0], "gluster volume info | egrep \"^Brick[0-9]+\"", \
-            verbose=False)
+    # The bricks are filtered here, so that the query can be cached
+    rc = tc.run_cached(servers[0], "gluster volume info", verbose=False)
+    bricks = ''
+    if rc[0] == 0:
+        bricks = '\n'.join(re.findall(r'^Brick[0-9]+.*$', rc[1], re.M))
     for i in range(0, number_of_bricks):
         if not snap:
             bricks_list = "%s %s:%s/%s_brick%d" % \
                 (bricks_list, servers[n], brick_root, volname, i)
         else:
-            sn = len(re.findall(servers[n], rc[1])) + tempn
+            sn = len(re.findall(servers[n], bricks)) + tempn
             bricks_list = "%s %s:%s/brick%d/%s_brick%d" % \
             (bricks_list, servers[n], brick_root, sn, volname, i)
         if n < len(servers[:]) - 1:
@@ -134,13 +135,24 @@ def stop_volume(volname, mnode='', force=False):
     return True
 
 
-def delete_volume(volname, mnode=''):
+def delete_volume(volname, mnode='', background_cleanup=''):
     """
-        Deletes the gluster volume
+        Deletes the gluster volume and removes its brick directories.
+        The bricks are removed in parallel across the nodes, with a single
+        command per node.
+
+        If background_cleanup is True (defaults to 'background_brick_cleanup'
+        from config, False if not set), the brick directories are just moved
+        to a trash directory next to them and removed in the background. So
+        the brick paths are free to be reused as soon as this returns.
+
         Returns True if success and False if failure
     """
     if mnode == '':
         mnode = tc.nodes[0]
+    if background_cleanup == '':
+        background_cleanup = tc.global_config.get('background_brick_cleanup', \
+                False)
     volinfo = get_volume_info(volname, mnode)
     if volinfo is None or volname not in volinfo:
         tc.logger.info("Volume %s does not exist in %s" % (volname, mnode))
@@ -153,9 +165,31 @@ def delete_volume(volname, mnode=''):
         del tc.global_flag[volname]
     except KeyError:
         pass
+    brick_dirs = {}
     for brick in bricks:
         node, vol_dir = brick.split(":")
-        ret = tc.run(node, "rm -rf %s" % vol_dir)
+        brick_dirs.setdefault(node, []).append(vol_dir)
+    commands = {}
+    for node, dirs in brick_dirs.items():
+        if not background_cleanup:
+            commands[node] = "rm -rf %s" % " ".join(dirs)
+            continue
+        # The trash is in the same file system as the brick, so that the
+        # move is a rename. The brick is removed now if it can not be moved
+        # (or the trash can not be made), and the command fails if that
+        # fails too.
+        cmd = "trash=''; failed=0; "
+        for vol_dir in dirs:
+            cmd += "t=$(mktemp -d %s/.distaf_trash.XXXXXX) && " \
+                   "trash=\"$trash $t\" && mv %s $t/ || rm -rf %s || " \
+                   "failed=1; " % (os.path.dirname(vol_dir), vol_dir, vol_dir)
+        commands[node] = cmd + "nohup rm -rf $trash > /dev/null 2>&1 " \
+                "< /dev/null & exit $failed"
+    results = tc.run_parallel(commands)
+    for node, result in results.items():
+        if result[0] != 0:
+            tc.logger.error("Unable to remove the bricks %s of %s in %s" \
+                    % (brick_dirs[node], volname, node))
 
     return True
 
@@ -221,15 +255,17 @@ def setup_meta_vol(servers=''):
             _n = 0
     gluster_cmd = "gluster volume create %s %s %s force" \
             % (meta_volname, repc, bricks)
-    ret = tc.run(servers[0], gluster_cmd)
-    if ret[0] != 0:
+    ret = tc.run_batch(servers[0], [gluster_cmd, \
+            "gluster volume start %s" % meta_volname])
+    if ret is None or ret[0][0] != 0:
         tc.logger.error("Unable to create meta volume")
         return False
-    ret = start_volume(meta_volname, servers[0])
-    if not ret:
+    if ret[-1][0] != 0:
         tc.logger.error("Unable to start the meta volume")
         return False
-    time.sleep(5)
+    if not wait_for_bricks_online(meta_volname, servers[0]):
+        tc.logger.error("Bricks of the meta volume did not come online")
+        return False
     for server in servers:
         ret = mount_volume(meta_volname, 'glusterfs', mount_point, server, \
                 server)
@@ -239,6 +275,34 @@ def setup_meta_vol(servers=''):
     return True
 
 
+def get_voltype_params(voltype, config_data):
+    """
+        Returns the tuple of (dist, rep, dispd, red, stripe, trans) to be
+        passed to setup_vol, for the voltype as configured in config_data.
+        Returns None if the voltype is not known.
+    """
+    dist = rep = dispd = red = stripe = 1
+    trans = ''
+    if voltype == 'distribute':
+        dist = config_data[voltype]['dist_count']
+    elif voltype == 'replicate':
+        rep = config_data[voltype]['replica']
+    elif voltype == 'dist_rep':
+        dist = config_data[voltype]['dist_count']
+        rep = config_data[voltype]['replica']
+    elif voltype == 'disperse':
+        dispd = config_data[voltype]['disperse']
+        red = config_data[voltype]['redundancy']
+    elif voltype == 'dist_disperse':
+        dist = config_data[voltype]['dist_count']
+        dispd = config_data[voltype]['disperse']
+        red = config_data[voltype]['redundancy']
+    else:
+        return None
+    trans = config_data[voltype]['transport']
+    return (dist, rep, dispd, red, stripe, trans)
+
+
 def setup_vol(volname='', dist='', rep='', dispd='', red='', stripe='', \
         trans='', servers=''):
     """
@@ -257,7 +321,7 @@ def setup_vol(volname='', dist='', rep='', dispd='', red='', stripe='', \
     if servers == '':
         servers = tc.nodes
     volinfo = get_volume_info(server=servers[0])
-    if volinfo is not None and volname in volinfo.keys():
+    if volinfo is not None and volname in volinfo:
         tc.logger.debug("volume %s already exists in %s. Returning..." \
                 % (volname, servers[0]))
         return True
@@ -269,7 +333,9 @@ def setup_vol(volname='', dist='', rep='', dispd='', red='', stripe='', \
     if not ret:
         tc.logger.error("glusterd did not start in at least one server")
         return False
-    time.sleep(5)
+    if not wait_for_glusterd(servers):
+        tc.logger.error("glusterd is not responding in at least one server")
+        return False
     ret = peer_probe(servers[0], servers[1:])
     if not ret:
         tc.logger.error("Unable to peer probe one or more machines")
@@ -284,42 +350,23 @@ def setup_vol(volname='', dist='', rep='', dispd='', red='', stripe='', \
     if ret[0] != 0:
         tc.logger.error("Unable to create volume %s" % volname)
         return False
-    time.sleep(2)
     ret = start_volume(volname, servers[0])
     if not ret:
         tc.logger.error("volume start %s failed" % volname)
         return False
+    if not wait_for_bricks_online(volname, servers[0]):
+        tc.logger.error("Bricks of volume %s did not come online" % volname)
+        return False
     tc.global_flag[volname] = True
     return True
 
 
-def _parse_volume_status_xml(root_xml):
-    """
-    Helper module for get_volume_status. It takes root xml object as input,
-    parses and returns the 'volume' tag xml object.
-    """
-    for element in root_xml:
-        if element.findall("volume"):
-            return element.findall("volume")
-        root_vol = _parse_volume_status_xml(element)
-        if root_vol is not None:
-            return root_vol
-
-
 def parse_xml(tag_obj):
     """
     This module takes any xml element object and parses all the child nodes
     and returns the parsed data in dictionary format
     """
-    node_dict = {}
-    for tag in tag_obj:
-        if re.search(r'\n\s+', tag.text) is not None:
-            port_dict = {}
-            port_dict = parse_xml(tag)
-            node_dict[tag.tag] = port_dict
-        else:
-            node_dict[tag.tag] = tag.text
-    return node_dict
+    return element_to_dict(tag_obj)
 
 
 def get_volume_status(volname='all', service='', options='', mnode=''):
@@ -337,7 +384,8 @@ def get_volume_status(volname='all', service='', options='', mnode=''):
         * options - <str> (optional) options can be,
                     [detail|clients|mem|inode|fd|callpool|tasks]. If not given,
                     the function returns the output of gluster volume status
-    @Returns: volume status in dict of dictionary format, on success
+    @Returns: volume status as a dict like object of volume name to its
+              VolumeStatus (see gluster_xml), on success
               None, on failure
     """
 
@@ -351,64 +399,10 @@ def get_volume_status(volname='all', service='', options='', mnode=''):
         tc.logger.error("Failed to execute gluster volume status command")
         return None
 
-    root = etree.XML(ret[1])
-    volume_list = _parse_volume_status_xml(root)
-    if volume_list is None:
+    vol_status = parse_volume_status(ret[1])
+    if not vol_status:
         tc.logger.error("No volumes exists in the gluster")
         return None
-
-    vol_status = {}
-    for volume in volume_list:
-        tmp_dict1 = {}
-        tmp_dict2 = {}
-        vol_name = [vol.text for vol in volume if vol.tag == "volName"]
-
-        # parsing volume status xml output
-        if options == 'tasks':
-            tasks = volume.findall("tasks")
-            for each_task in tasks:
-                tmp_dict3 = parse_xml(each_task)
-                node_name = 'task_status'
-                if 'task' in tmp_dict3.keys():
-                    if node_name in tmp_dict2.keys():
-                        tmp_dict2[node_name].append(tmp_dict3['task'])
-                    else:
-                        tmp_dict2[node_name] = [tmp_dict3['task']]
-                else:
-                    tmp_dict2[node_name] = [tmp_dict3]
-        else:
-            nodes = volume.findall("node")
-            for each_node in nodes:
-                if each_node.find('path').text.startswith('/'):
-                    node_name = each_node.find('hostname').text
-                else:
-                    node_name = each_node.find('path').text
-                node_dict = parse_xml(each_node)
-                tmp_dict3 = {}
-                if "hostname" in node_dict.keys():
-                    if node_dict['path'].startswith('/'):
-                        tmp = node_dict["path"]
-                        tmp_dict3[node_dict["path"]] = node_dict
-                    else:
-                        tmp_dict3[node_dict["hostname"]] = node_dict
-                        tmp = node_dict["hostname"]
-                    del tmp_dict3[tmp]["path"]
-                    del tmp_dict3[tmp]["hostname"]
-
-                if node_name in tmp_dict1.keys():
-                    tmp_dict1[node_name].append(tmp_dict3)
-                else:
-                    tmp_dict1[node_name] = [tmp_dict3]
-
-                tmp_dict4 = {}
-                for item in tmp_dict1[node_name]:
-                    for key, val in item.items():
-                        tmp_dict4[key] = val
-                tmp_dict2[node_name] = tmp_dict4
-
-        vol_status[vol_name[0]] = tmp_dict2
-    tc.logger.debug("Volume status output: %s" \
-                    % pformat(vol_status, indent=10))
     return vol_status
 
 
@@ -430,7 +424,7 @@ def get_volume_option(volname, option='all', server=''):
         server = tc.nodes[0]
 
     cmd = "gluster volume get %s %s" % (volname, option)
-    ret = tc.run(server, cmd)
+    ret = tc.run_cached(server, cmd)
     if ret[0] != 0:
         tc.logger.error("Failed to execute gluster volume get command")
         return None
@@ -454,7 +448,8 @@ def get_volume_info(volname='all', server=''):
         Fetches the volume information as displayed in the volume info.
         Uses xml output of volume info and parses the into to a dict
 
-        Returns a dict of dicts.
+        Returns a dict like object (see gluster_xml), which parses the
+        volumes only as far as needed for the lookups.
         -- Volume name is the first key
         -- distCount/replicaCount/Type etc are second keys
         -- The value of the each second level dict depends on the key
@@ -463,33 +458,14 @@ def get_volume_info(volname='all', server=''):
     """
     if server == '':
         server = tc.nodes[0]
-    ret = tc.run(server, "gluster volume info %s --xml" % volname, \
+    ret = tc.run_cached(server, "gluster volume info %s --xml" % volname, \
             verbose=False)
     if ret[0] != 0:
         tc.logger.error("volume info returned error")
         return None
-    root = etree.XML(ret[1])
-    volinfo = {}
-    for volume in root.findall("volInfo/volumes/volume"):
-        for elem in volume.getchildren():
-            if elem.tag == "name":
-                volname = elem.text
-                volinfo[volname] = {}
-            elif elem.tag == "bricks":
-                volinfo[volname]["bricks"] = []
-                for el in elem.getiterator():
-                    if el.tag == "name":
-                        volinfo[volname]["bricks"].append(el.text)
-            elif elem.tag == "options":
-                volinfo[volname]["options"] = {}
-                for option in elem.findall("option"):
-                    for el in option.getchildren():
-                        if el.tag == "name":
-                            opt = el.text
-                        if el.tag == "value":
-                            volinfo[volname]["options"][opt] = el.text
-            else:
-                volinfo[volname][elem.tag] = elem.text
+    volinfo = parse_volume_info(ret[1])
+    if volinfo is None:
+        tc.logger.error("volume info returned error")
     return volinfo
 
 
@@ -505,13 +481,47 @@ def set_volume_option(volname, options, server=''):
     @Returns: True, on success
               False, on failure
     """
+    results = set_volume_options(volname, options, server)
+    return results is not None and False not in results.values()
+
+
+def set_volume_options(volname, options, server='', skip_current=True):
+    """
+    Sets all the given options of the volume in a single round trip, with
+    one batch of gluster volume set commands.
+    @parameter:
+        * volname - <str> name of the volume
+        * options - <dict> of volume option to its value
+        * server  - <str> (optional) name of the server to run the commands.
+                    If not given, the first node from config file is used
+        * skip_current - <bool> (optional) if True, options which already
+                    have the given value (as per gluster volume get) are
+                    not set again
+    @Returns: dict of each option to True if it was set, False if setting
+              it failed and None if it was skipped as it was already set
+              None, if the commands could not be run
+    """
     if server == '':
         server = tc.nodes[0]
-    _rc = True
+    current = {}
+    if skip_current:
+        current = get_volume_option(volname, 'all', server) or {}
+    results = {}
+    to_set = []
     for option in options:
-        cmd = "gluster volume set %s %s %s" % (volname, option, \
-                options[option])
-        ret = tc.run(server, cmd)
-        if ret[0] != 0:
-            _rc = False
-    return _rc
+        if option in current and current[option] == str(options[option]):
+            tc.logger.debug("Option %s of %s is already %s. Skipping it" \
+                    % (option, volname, options[option]))
+            results[option] = None
+        else:
+            to_set.append(option)
+    if not to_set:
+        return results
+    cmds = ["gluster volume set %s %s %s" % (volname, option, \
+            options[option]) for option in to_set]
+    ret = tc.run_batch(server, cmds, stop_on_failure=False)
+    if ret is None:
+        return None
+    for option, (retcode, _, _) in zip(to_set, ret):
+        results[option] = retcode == 0
+    return results
@@ -0,0 +1,230 @@
+#  This file is part of DiSTAF
+#  Copyright (C) 2015-2016  Red Hat, Inc. <http://www.redhat.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Pool of ready to use volumes of each voltype, for the testcases which
+    do not reuse the setup.
+
+    The volumes are created (and the returned ones cleaned up) by a
+    background thread, so that testcases do not wait for the volume
+    create/start/cleanup, except when the pool has run dry.
+"""
+
+
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from distaf.util import tc, finii_hooks
+from distaf.volume_ops import setup_vol, cleanup_volume, reset_volume, \
+        get_voltype_params
+
+
+class VolumePool():
+    """
+        Keeps size started volumes of each voltype ready. The volumes are
+        named <voltype>-pool-<n>.
+    """
+    def __init__(self, config_data, size=1, servers=''):
+        if servers == '':
+            servers = tc.nodes
+        self.config_data = config_data
+        self.size = size
+        self.servers = servers
+        self.ready = {}
+        self.count = 0
+        self.lock = threading.Lock()
+        self.tasks = queue.Queue()
+        # Set unless the pool is paused, busy is held while doing a task
+        self.running = threading.Event()
+        self.running.set()
+        self.busy = threading.Lock()
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _ready_queue(self, voltype):
+        with self.lock:
+            return self.ready.setdefault(voltype, queue.Queue())
+
+    def prefill(self, voltypes):
+        """
+            Starts building size volumes of each of the voltypes
+        """
+        for voltype in voltypes:
+            for _ in range(self.size - self._ready_queue(voltype).qsize()):
+                self.tasks.put(('build', voltype, None))
+
+    def checkout(self, voltype, timeout=1800):
+        """
+            Takes a ready volume of voltype out of the pool, waiting for
+            one to be built if there is none, and builds one more to take
+            its place.
+
+            Returns the volume name, None if no volume was ready in time
+        """
+        ready = self._ready_queue(voltype)
+        if ready.empty():
+            tc.logger.info("No %s volume is ready in the pool. Waiting for "
+                           "one" % voltype)
+            self.tasks.put(('build', voltype, None))
+        try:
+            volname = ready.get(timeout=timeout)
+        except queue.Empty:
+            tc.logger.error("No %s volume got ready in %s seconds" \
+                    % (voltype, timeout))
+            return None
+        self.tasks.put(('build', voltype, None))
+        tc.logger.info("Checked out the volume %s from the pool" % volname)
+        return volname
+
+    def checkin(self, volname, voltype, recycle=True):
+        """
+            Returns the volume to the pool. If recycle is True, the volume
+            is cleaned up in the background (a new one is built in its place
+            at checkout). Otherwise its options are reset and it is reused
+            as it is.
+        """
+        if recycle:
+            self.tasks.put(('recycle', voltype, volname))
+        elif reset_volume(volname, self.servers[0], True):
+            self._ready_queue(voltype).put(volname)
+        else:
+            tc.logger.error("Unable to reset the volume %s. Recycling it" \
+                    % volname)
+            self.tasks.put(('recycle', voltype, volname))
+
+    def pause(self):
+        """
+            Stops building and recycling volumes, after the one being built
+            or recycled is done. The tasks are kept for resume. Checking
+            out a volume from a paused pool waits for one to be ready.
+        """
+        self.running.clear()
+        with self.busy:
+            pass
+
+    def resume(self):
+        """
+            Resumes building and recycling volumes after pause
+        """
+        self.running.set()
+
+    def shutdown(self):
+        """
+            Stops building volumes and cleans up the ready volumes
+        """
+        self.resume()
+        # The pending builds are dropped, their volumes would only be
+        # cleaned up right away. The pending recycles are kept.
+        recycles = []
+        while True:
+            try:
+                task = self.tasks.get_nowait()
+            except queue.Empty:
+                break
+            if task is not None and task[0] == 'recycle':
+                recycles.append(task)
+        for task in recycles:
+            self.tasks.put(task)
+        self.tasks.put(None)
+        self.thread.join()
+        with self.lock:
+            ready = self.ready.values()
+        for volumes in ready:
+            while not volumes.empty():
+                cleanup_volume(volumes.get(), self.servers[0])
+
+    def _serve(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            while True:
+                self.running.wait()
+                with self.busy:
+                    # Paused after the wait returned
+                    if not self.running.is_set():
+                        continue
+                    self._do(*task)
+                    break
+
+    def _do(self, action, voltype, volname):
+        try:
+            if action == 'recycle':
+                cleanup_volume(volname, self.servers[0])
+            elif self._ready_queue(voltype).qsize() < self.size:
+                self._build(voltype)
+        except Exception:
+            tc.logger.exception("Unable to %s a %s volume for the pool" \
+                    % (action, voltype))
+
+    def _build(self, voltype):
+        params = get_voltype_params(voltype, self.config_data)
+        if params is None:
+            tc.logger.error("The volume type %s is not present" % voltype)
+            return
+        with self.lock:
+            self.count += 1
+            volname = "%s-pool-%d" % (voltype, self.count)
+        tc.logger.info("Building the volume %s for the pool" % volname)
+        if setup_vol(volname, *params, servers=self.servers):
+            self._ready_queue(voltype).put(volname)
+        else:
+            tc.logger.error("Unable to setup the volume %s for the pool" \
+                    % volname)
+
+
+_pool = None
+
+
+def get_pool(config_data, voltypes=()):
+    """
+        Returns the volume pool, creating it if 'volume_pool_size' is set
+        in config. The pool starts building the volumes of voltypes (or of
+        'volume_pool_voltypes' from config) right away.
+
+        Returns None if the pool is not enabled
+    """
+    global _pool
+    if _pool is None:
+        size = config_data.get('volume_pool_size', 0)
+        if not size:
+            return None
+        _pool = VolumePool(config_data, size)
+        finii_hooks.append(_pool.shutdown)
+        _pool.prefill(config_data.get('volume_pool_voltypes') or voltypes)
+    return _pool
+
+
+def pause_pool():
+    """
+        Pauses the volume pool, if it is running. For the testcases which
+        restart glusterd or reboot the nodes.
+    """
+    if _pool is not None:
+        tc.logger.info("Pausing the volume pool")
+        _pool.pause()
+
+
+def resume_pool():
+    """
+        Resumes the volume pool paused by pause_pool
+    """
+    if _pool is not None:
+        _pool.resume()
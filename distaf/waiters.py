@@ -0,0 +1,196 @@
+#  This file is part of DiSTAF
+#  Copyright (C) 2015-2016  Red Hat, Inc. <http://www.redhat.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Waiters for the gluster cluster to reach a state, to be used instead of
+    sleeping for a fixed time.
+
+    The state is polled, first after a few milliseconds and then backing off
+    exponentially, till it is reached or the timeout expires. The queries
+    are run with tc.run, never from the query cache. This module depends
+    only on tc, so that all the other libraries can use it.
+"""
+
+
+import re
+import time
+from distaf.util import tc
+try:
+    import xml.etree.cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+
+
+def wait_for(condition, timeout=60, first_delay=0.005, max_delay=2, \
+        description='the condition'):
+    """
+        Calls condition till it returns True, sleeping first_delay seconds
+        after the first call and doubling the sleep (up to max_delay) after
+        each call.
+
+        Returns True if condition returned True within timeout seconds,
+        False otherwise
+    """
+    started = time.time()
+    deadline = started + timeout
+    delay = first_delay
+    while True:
+        if condition():
+            tc.logger.debug("Waited %.3f seconds for %s" \
+                    % (time.time() - started, description))
+            return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            tc.logger.error("Timed out after %s seconds waiting for %s" \
+                    % (timeout, description))
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+
+def wait_for_glusterd(servers='', timeout=60):
+    """
+        Waits till glusterd in all the servers serve the gluster cli
+
+        Returns True if glusterd is up in all servers, False otherwise
+    """
+    if servers == '':
+        servers = tc.nodes
+    pending = set(servers)
+
+    def glusterd_ready():
+        results = tc.run_parallel(dict([(server, "gluster pool list") \
+                for server in pending]), verbose=False)
+        for server, result in results.items():
+            if result[0] == 0:
+                pending.discard(server)
+        return not pending
+
+    return wait_for(glusterd_ready, timeout, \
+            description="glusterd in %s" % list(pending))
+
+
+def _peer_states(pnode):
+    """
+        Returns a dict of hostname to the state of each peer of pnode as in
+        gluster peer status. Returns None on failure.
+    """
+    ret = tc.run(pnode, "gluster peer status", verbose=False)
+    if ret[0] != 0:
+        return None
+    states = {}
+    hostname = None
+    for line in ret[1].split('\n'):
+        match = re.match(r'^(Hostname|State):\s*(.*)$', line.strip())
+        if match is None:
+            continue
+        if match.group(1) == 'Hostname':
+            hostname = match.group(2)
+        elif hostname is not None:
+            states[hostname] = match.group(2)
+    return states
+
+
+def wait_for_peers_connected(servers, pnode='', timeout=60):
+    """
+        Waits till all the servers are in the cluster and connected, as per
+        gluster peer status in pnode
+
+        Returns True if all servers are connected peers, False otherwise
+    """
+    if pnode == '':
+        pnode = tc.nodes[0]
+
+    def peers_connected():
+        states = _peer_states(pnode)
+        return states is not None and all([states.get(server) == \
+                "Peer in Cluster (Connected)" for server in servers])
+
+    return wait_for(peers_connected, timeout, \
+            description="peers %s to be connected" % list(servers))
+
+
+def wait_for_peers_detached(servers, pnode='', timeout=60):
+    """
+        Waits till none of the servers is a peer of pnode
+
+        Returns True if all servers are detached, False otherwise
+    """
+    if pnode == '':
+        pnode = tc.nodes[0]
+
+    def peers_detached():
+        states = _peer_states(pnode)
+        return states is not None and \
+                not set(servers).intersection(states.keys())
+
+    return wait_for(peers_detached, timeout, \
+            description="peers %s to be detached" % list(servers))
+
+
+def wait_for_volume_started(volname, mnode='', timeout=60):
+    """
+        Waits till the volume is in Started state
+
+        Returns True if the volume is started, False otherwise
+    """
+    if mnode == '':
+        mnode = tc.nodes[0]
+
+    def volume_started():
+        ret = tc.run(mnode, "gluster volume info %s" % volname, verbose=False)
+        return ret[0] == 0 and \
+                re.search(r'^Status:\s*Started', ret[1], re.M) is not None
+
+    return wait_for(volume_started, timeout, \
+            description="volume %s to be started" % volname)
+
+
+def wait_for_bricks_online(volname, mnode='', timeout=60):
+    """
+        Waits till the volume is started and all its bricks are online, as
+        per gluster volume status in mnode
+
+        Returns True if all the bricks are online, False otherwise
+    """
+    if mnode == '':
+        mnode = tc.nodes[0]
+    if not wait_for_volume_started(volname, mnode, timeout):
+        return False
+    ret = tc.run(mnode, "gluster volume info %s --xml" % volname, \
+            verbose=False)
+    if ret[0] != 0:
+        tc.logger.error("Unable to get the bricks of volume %s" % volname)
+        return False
+    root = etree.XML(ret[1])
+    bricks = set([brick.text for brick in \
+            root.findall("volInfo/volumes/volume/bricks/brick/name")])
+
+    def bricks_online():
+        ret = tc.run(mnode, "gluster volume status %s --xml" % volname, \
+                verbose=False)
+        if ret[0] != 0:
+            return False
+        online = set()
+        for node in etree.XML(ret[1]).findall("volStatus/volumes/volume/node"):
+            if node.findtext("status") == "1":
+                online.add("%s:%s" % (node.findtext("hostname"), \
+                        node.findtext("path")))
+        return bricks.issubset(online)
+
+    return wait_for(bricks_online, timeout, \
+            description="bricks of %s to be online" % volname)
@@ -0,0 +1,51 @@
+#  This file is part of DiSTAF
+#  Copyright (C) 2015-2016  Red Hat, Inc. <http://www.redhat.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+
+import unittest
+from distaf.client_rpyc import GLUSTER_QUERY
+
+
+class TestGlusterQuery(unittest.TestCase):
+    def test_queries(self):
+        for cmd in ("gluster volume info", "gluster v info v1 --xml", \
+                "gluster vol status all detail", "gluster volume get v1 all", \
+                "gluster peer status", "gluster pool list", \
+                "gluster v rebalance v1 status --xml", \
+                "gluster volume heal v1 info", "gluster snapshot list v1", \
+                "gluster --version", "gluster --mode=script volume status"):
+            self.assertTrue(GLUSTER_QUERY.match(cmd), cmd)
+
+    def test_mutations(self):
+        for cmd in ("gluster volume create status-vol replica 2 a:/b", \
+                "gluster volume stop info --mode=script", \
+                "gluster volume rebalance v1 start", \
+                "gluster snapshot config v1 snap-max-hard-limit 10", \
+                "gluster peer probe status"):
+            self.assertFalse(GLUSTER_QUERY.match(cmd), cmd)
+
+    def test_chained(self):
+        for cmd in ("gluster volume set v1 a b ; gluster volume info", \
+                "gluster volume info && gluster volume stop v1", \
+                "gluster volume info | egrep Brick", \
+                "gluster volume info\ngluster volume delete v1"):
+            self.assertFalse(GLUSTER_QUERY.match(cmd), cmd)
+
+
+if __name__ == '__main__':
+    unittest.main()
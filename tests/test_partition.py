@@ -0,0 +1,55 @@
+#  This file is part of DiSTAF
+#  Copyright (C) 2015-2016  Red Hat, Inc. <http://www.redhat.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import unittest
+from distaf.partition import nodes_needed, partition_count
+
+
+CONFIG = {
+    'replicate': {'replica': 2, 'transport': 'tcp'},
+    'dist_rep': {'dist_count': 2, 'replica': 3, 'transport': 'tcp'},
+    'disperse': {'disperse': 4, 'redundancy': 2, 'transport': 'tcp'},
+    'dist_disperse': {'dist_count': 2, 'disperse': 4, 'redundancy': 2, \
+            'transport': 'tcp'},
+    'distribute': {'dist_count': 4, 'transport': 'tcp'},
+    'nodes': dict([("server%d" % i, {}) for i in range(12)]),
+    'clients': {'client0': None, 'client1': None, 'client2': None},
+}
+
+
+class TestNodesNeeded(unittest.TestCase):
+    def test_replicate(self):
+        self.assertEqual(nodes_needed('replicate', CONFIG), 2)
+        self.assertEqual(nodes_needed('dist_rep', CONFIG), 3)
+
+    def test_disperse(self):
+        # Each disperse set has disperse-data + redundancy bricks
+        self.assertEqual(nodes_needed('disperse', CONFIG), 6)
+        self.assertEqual(nodes_needed('dist_disperse', CONFIG), 6)
+
+    def test_distribute(self):
+        self.assertEqual(nodes_needed('distribute', CONFIG), 1)
+        self.assertEqual(nodes_needed('unknown', CONFIG), 1)
+
+    def test_partition_count(self):
+        self.assertEqual(partition_count(3, ['disperse'], CONFIG), 2)
+        self.assertEqual(partition_count(3, ['replicate'], CONFIG), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#  This file is part of DiSTAF
+#  Copyright (C) 2015-2016  Red Hat, Inc. <http://www.redhat.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+
+import unittest
+from distaf.rebalance import parse_rebal_status_xml, _rebal_state
+
+
+NODE = """<node><nodeName>%s</nodeName><files>%d</files><size>0</size>
+<lookups>10</lookups><failures>0</failures><skipped>0</skipped>
+<status>3</status><statusStr>%s</statusStr><runtime>2.00</runtime></node>"""
+
+XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<cliOutput><opRet>0</opRet><opErrno>0</opErrno><opErrstr/><volRebalance>
+<op>%d</op><nodeCount>2</nodeCount>%s%s<aggregate><files>0</files>
+<size>0</size><lookups>20</lookups><failures>0</failures><skipped>0</skipped>
+<status>3</status><statusStr>%s</statusStr><runtime>2.00</runtime>
+</aggregate></volRebalance></cliOutput>"""
+
+
+def rebal_xml(first, second, op=3):
+    return XML % (op, NODE % ('localhost', 5, first), \
+            NODE % ('server2', 0, second), first)
+
+
+class TestRebalState(unittest.TestCase):
+    def test_completed(self):
+        records = parse_rebal_status_xml(rebal_xml('completed', 'completed'))
+        state, rebal_dict = _rebal_state(records)
+        self.assertEqual(state, 'completed')
+        self.assertEqual(rebal_dict['localhost'][0], '5')
+
+    def test_fix_layout_completed(self):
+        records = parse_rebal_status_xml(rebal_xml('fix-layout completed', \
+                'fix-layout completed', op=2))
+        self.assertEqual(_rebal_state(records)[0], 'completed')
+
+    def test_in_progress(self):
+        records = parse_rebal_status_xml(rebal_xml('fix-layout completed', \
+                'fix-layout in progress', op=2))
+        self.assertEqual(_rebal_state(records)[0], 'in progress')
+
+    def test_failed(self):
+        records = parse_rebal_status_xml(rebal_xml('completed', 'failed'))
+        self.assertEqual(_rebal_state(records)[0], 'failed')
+
+    def test_not_started(self):
+        self.assertEqual(parse_rebal_status_xml("<cliOutput><opRet>-1"
+                "</opRet></cliOutput>"), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#  This file is part of DiSTAF
+#  Copyright (C) 2015-2016  Red Hat, Inc. <http://www.redhat.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from distaf.results_store import ResultsStore
+
+
+class TestResultsStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'results.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_failed_phases_ignored(self):
+        store = ResultsStore(self.path, until=time.time() + 60)
+        store.record('setup', 'replicate', 'glusterfs', 100.0, 't1', True)
+        store.record('setup', 'replicate', 'glusterfs', 2.0, 't1', False)
+        store.record('setup', 'replicate', 'glusterfs', 50.0, 't1')
+        self.assertEqual(store.get('setup', 'replicate', 'glusterfs', \
+                't1'), 75.0)
+
+    def test_until(self):
+        store = ResultsStore(self.path)
+        store.record('run', 'replicate', 'glusterfs', 10.0, 't1', True)
+        self.assertEqual(store.get('run', 'replicate', 'glusterfs', 't1'), \
+                store.defaults['run'])
+        store = ResultsStore(self.path, until=time.time() + 60)
+        self.assertEqual(store.get('run', 'replicate', 'glusterfs', 't1'), \
+                10.0)
+
+
+if __name__ == '__main__':
+    unittest.main()